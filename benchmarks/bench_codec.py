@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Compare loads and dumps of every installed JSON library on a tender of real size.
+
+    python benchmarks/bench_codec.py [--awards 40] [--documents 10] [--number 50]
+"""
+import argparse
+import timeit
+from uuid import uuid4
+
+from bot.dfs.bridge import codec
+
+
+def document(i):
+    return {"id": uuid4().hex, "title": u"Документ {}.pdf".format(i), "format": "application/pdf",
+            "url": "https://public-docs.prozorro.gov.ua/get/{}?KeyID=a8968c46&Signature=3q2%2B7w%3D%3D".format(
+                uuid4().hex),
+            "documentOf": "tender", "datePublished": "2017-10-10T12:00:00.000000+03:00",
+            "dateModified": "2017-10-10T12:00:00.000000+03:00", "hash": "md5:" + uuid4().hex}
+
+
+def organization(i):
+    return {"name": u"ТОВ «Будівельна компанія {}»".format(i),
+            "identifier": {"scheme": "UA-EDR", "id": "{:08d}".format(14360570 + i),
+                           "legalName": u"Товариство з обмеженою відповідальністю «Будівельна компанія {}»".format(i)},
+            "address": {"countryName": u"Україна", "postalCode": "01001", "region": u"м. Київ",
+                        "locality": u"Київ", "streetAddress": u"вул. Хрещатик, {}".format(i)},
+            "contactPoint": {"name": u"Петренко Петро Петрович", "telephone": "+380440000000",
+                             "email": "office{}@example.com".format(i)}}
+
+
+def tender(awards, documents):
+    bids = [{"id": uuid4().hex, "status": "active", "date": "2017-10-10T12:00:00.000000+03:00",
+             "tenderers": [organization(i)], "value": {"amount": 100000 + i, "currency": "UAH"},
+             "documents": [document(j) for j in range(documents)]} for i in range(awards)]
+    return {"id": uuid4().hex, "tenderID": "UA-2017-10-10-000001-a", "status": "active.qualification",
+            "procurementMethodType": "aboveThresholdUA", "dateModified": "2017-10-10T12:00:00.000000+03:00",
+            "title": u"Капітальний ремонт приміщень адміністративної будівлі", "procuringEntity": organization(0),
+            "documents": [document(i) for i in range(documents)],
+            "items": [{"id": uuid4().hex, "description": u"Ремонтні роботи, етап {}".format(i),
+                       "classification": {"scheme": u"ДК021", "id": "45453000-7",
+                                          "description": u"Капітальний ремонт і реставрація"},
+                       "quantity": i + 1, "unit": {"code": "E48", "name": u"послуга"}} for i in range(10)],
+            "bids": bids,
+            "awards": [{"id": uuid4().hex, "bid_id": bid["id"], "status": "active" if i == 0 else "unsuccessful",
+                        "suppliers": bid["tenderers"], "value": bid["value"], "documents": bid["documents"],
+                        "date": "2017-10-10T12:00:00.000000+03:00"} for i, bid in enumerate(bids)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--awards', type=int, default=40)
+    parser.add_argument('--documents', type=int, default=10)
+    parser.add_argument('--number', type=int, default=50)
+    args = parser.parse_args()
+    body = codec.dumps({"data": tender(args.awards, args.documents)})
+    data = codec.loads(body)
+    print("tender body: {} KB, {} runs".format(len(body) // 1024, args.number))
+    results = {}
+    for name, loads, dumps in codec.installed_backends():
+        results[name] = (min(timeit.repeat(lambda: loads(body), number=args.number, repeat=3)) / args.number,
+                         min(timeit.repeat(lambda: dumps(data), number=args.number, repeat=3)) / args.number)
+    base = results.get('simplejson')
+    for name, (load_time, dump_time) in sorted(results.items(), key=lambda item: item[1]):
+        print("{:<12} loads {:7.2f} ms ({:4.1f}x)  dumps {:7.2f} ms ({:4.1f}x)".format(
+            name, load_time * 1000, base[0] / load_time, dump_time * 1000, base[1] / dump_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Time RequestsDb.migrate_code_indexes on requests stored in the layout which preceded the per-code indexes.
+
+    python benchmarks/bench_migration.py [--requests 1000000] [--codes 50000] [--port 6379] [--db 15]
+
+The given redis database is flushed before and after the run.
+"""
+import argparse
+from random import randrange
+from time import time
+
+from bot.dfs.bridge.caching import Db
+from bot.dfs.bridge.data import Data
+from bot.dfs.bridge.requests_db import RequestsDb
+
+
+def fill(redis, requests, codes, chunk=10000):
+    """Legacy requests:<id> hashes with one bound award each, requests:dates, requests:complete for every tenth
+    request and requests:pending for the rest"""
+    now = time()
+    for start in range(0, requests, chunk):
+        pipe = redis.pipeline(transaction=False)
+        for request_id in range(start, min(start + chunk, requests)):
+            code = "{:08d}".format(randrange(codes))
+            award = award_key(request_id)
+            pipe.hmset("requests:{}".format(request_id), {"code": code, "status": "pending",
+                                                          "response": "placeholder"})
+            pipe.zadd("requests:dates", now - request_id, request_id)
+            pipe.sadd("requests:complete" if request_id % 10 == 0 else "requests:pending", request_id)
+            pipe.hmset(award, {"request_id": request_id, "data": Data(
+                "t{}".format(request_id), "a", code, "comname", {"meta": {"id": request_id}}).db_dump()})
+            pipe.sadd("tenders_of:{}".format(request_id), award)
+        pipe.execute()
+
+
+def award_key(request_id):
+    return "tender:t{}:a".format(request_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000000)
+    parser.add_argument('--codes', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    args = parser.parse_args()
+    db = Db({'main': {'cache_host': args.host, 'cache_port': args.port, 'cache_db_name': args.db}})
+    db.db.flushdb()
+    try:
+        fill(db.db, args.requests, args.codes)
+        started = time()
+        migrated = RequestsDb(db).migrate_code_indexes(args.batch_size)
+        elapsed = time() - started
+        print("migrated {} requests of {} codes in {:.1f} s ({:.0f} requests/s), batch size {}".format(
+            migrated, args.codes, elapsed, migrated / elapsed, args.batch_size))
+    finally:
+        db.db.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Compare ops/sec of caching.Db with the client it replaced, a bare StrictRedis which logged every call at INFO
+and ran KEYS before SMEMBERS, under concurrent greenlets.
+
+    python benchmarks/bench_pool.py [--greenlets 50] [--seconds 10] [--keys 100000] [--port 6379] [--db 15]
+
+The given redis database is flushed before and after the run.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import logging
+from itertools import count
+from random import randrange
+from time import time
+
+import gevent
+import redis
+
+from bot.dfs.bridge.caching import Db
+
+LOGGER = logging.getLogger("bench_pool")
+
+
+class LegacyDb(object):
+    """caching.Db as it was before the connection pool"""
+
+    def __init__(self, host, port, db):
+        self.db = redis.StrictRedis(host=host, port=port, db=db)
+
+    def get(self, key):
+        LOGGER.info("Getting item {} from the cache".format(key))
+        return self.db.get(key)
+
+    def put(self, key, value, ex=86400):
+        LOGGER.info("Saving key {} to cache".format(key))
+        self.db.set(key, value, ex)
+
+    def has(self, key):
+        LOGGER.info("Checking if code {} is in the cache".format(key))
+        return self.db.exists(key)
+
+    def smembers(self, key):
+        return self.db.smembers(key) if self.db.keys(key) else []
+
+
+def fill(client, keys, chunk=10000):
+    for start in range(0, keys, chunk):
+        pipe = client.pipeline(transaction=False)
+        for i in range(start, min(start + chunk, keys)):
+            pipe.set("key:{}".format(i), "value", ex=3600)
+        pipe.execute()
+    client.sadd("set", *range(100))
+
+
+def run(db, greenlets, seconds, keys, with_smembers):
+    """Every greenlet does get, put, has and, if with_smembers, smembers in a loop; returns ops/sec"""
+    done = count()
+    deadline = time() + seconds
+
+    def work():
+        while time() < deadline:
+            key = "key:{}".format(randrange(keys))
+            db.get(key)
+            db.put(key, "value", 3600)
+            db.has(key)
+            ops = 3
+            if with_smembers:
+                db.smembers("set")
+                ops += 1
+            for _ in range(ops):
+                next(done)
+
+    started = time()
+    gevent.joinall([gevent.spawn(work) for _ in range(greenlets)])
+    return next(done) / (time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--greenlets', type=int, default=50)
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    pooled = Db({'main': {'cache_host': args.host, 'cache_port': args.port, 'cache_db_name': args.db}})
+    legacy = LegacyDb(args.host, args.port, args.db)
+    pooled.db.flushdb()
+    try:
+        fill(pooled.db, args.keys)
+        print("{} greenlets, {} keys in the database, {} s per run".format(args.greenlets, args.keys, args.seconds))
+        for with_smembers in (False, True):
+            results = [(name, run(db, args.greenlets, args.seconds, args.keys, with_smembers))
+                       for name, db in (("legacy", legacy), ("pooled", pooled))]
+            print("{:<25} ".format("get/put/has/smembers" if with_smembers else "get/put/has") + "  ".join(
+                "{} {:8.0f} ops/s".format(name, ops) for name, ops in results) +
+                "  ({:.2f}x)".format(results[1][1] / results[0][1]))
+    finally:
+        pooled.db.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from bot.dfs.bridge.workers.request_for_reference import RequestForReference
+from bot.dfs.bridge.workers.requests_compactor import RequestsCompactor
 from bot.dfs.bridge.workers.sfs_worker import SfsWorker
 from bot.dfs.bridge.workers.upload_file_to_doc_service import UploadFileToDocService
 from bot.dfs.bridge.workers.upload_file_to_tender import UploadFileToTender
@@ -27,12 +28,15 @@ from process_tracker import ProcessTracker
 from bot.dfs.bridge.workers.scanner import Scanner
 from requests_db import RequestsDb
 from requests_to_sfs import RequestsToSfs
+from sfs_quota import SfsQuota
 from caching import Db
+from dedup_filter import DedupFilter
+from tender_queue import TenderQueue
 from bot.dfs.bridge.workers.filter_tender import FilterTenders
 from utils import journal_context, check_412
 from journal_msg_ids import (DATABRIDGE_RESTART_WORKER, DATABRIDGE_START, DATABRIDGE_DOC_SERVICE_CONN_ERROR)
 
-from sleep_change_value import APIRateController
+from sleep_change_value import APIRateController, TokenBucket
 
 logger = logging.getLogger(__name__)
 
@@ -62,12 +66,36 @@ class EdrDataBridge(object):
         ro_api_server = self.config_get('public_tenders_api_server') or api_server
         buffers_size = self.config_get('buffers_size') or 500
         self.delay = self.config_get('delay') or 15
+        self.full_stack_sync_delay = self.config_get('full_stack_sync_delay')
+        self.empty_stack_sync_delay = self.config_get('empty_stack_sync_delay')
+        self.on_error_sleep_delay = self.config_get('on_error_sleep_delay') or 5
+        self.feed_prefetch_pages = self.config_get('feed_prefetch_pages') or 0
+        self.dedup_capacity = self.config_get('dedup_capacity') or 50000
+        self.dedup_window = self.config_get('dedup_window') or 3600
+        self.backfill_share = self.config_get('backfill_share') or 0.1
+        self.filter_pool_size = self.config_get('filter_pool_size') or 1
+        self.fetch_awards_only = self.config_get('fetch_awards_only') or False
+        self.sfs_requests_per_minute = self.config_get('sfs_requests_per_minute') or 4
+        self.sfs_burst = self.config_get('sfs_burst') or 1
+        self.sfs_pool_size = self.config_get('sfs_pool_size') or 1
+        self.sfs_daily_quota = self.config_get('sfs_daily_quota') or 100
+        self.requests_retention = self.config_get('requests_retention') or 2592000
+        self.compaction_batch_size = self.config_get('compaction_batch_size') or 100
+        self.compaction_interval = self.config_get('compaction_interval') or 3600
         self.increment_step = self.config_get('increment_step') or 1
         self.decrement_step = self.config_get('decrement_step') or 1
         self.sleep_change_value = APIRateController(self.increment_step, self.decrement_step)
+        self.sfs_rate_limiter = TokenBucket(self.sfs_requests_per_minute, self.sfs_burst)
         self.sandbox_mode = os.environ.get('SANDBOX_MODE', 'False')
         self.time_to_live = self.config_get('time_to_live') or 300
-        self.time_range = self.config_get('time_range') or 0
+        self.time_to_live_date_modified = self.config_get('time_to_live_date_modified') or 2592000
+        self.time_to_live_processed = self.config_get('time_to_live_processed') or 2592000
+        self.time_to_live_validators = self.config_get('time_to_live_validators') or 604800
+        self.time_range = self.config_get('time_range') or 1000
+        self.full_resync = self.config_get('full_resync') or False
+        self.backward_shards = self.config_get('backward_shards') or 1
+        self.backward_pool_size = self.config_get('backward_pool_size') or 1
+        self.backward_history_days = self.config_get('backward_history_days') or 365
         self.doc_service_host = self.config_get('doc_service_server')
         self.doc_service_port = self.config_get('doc_service_port') or 6555
 
@@ -80,7 +108,8 @@ class EdrDataBridge(object):
                                                    password=self.config_get('doc_service_password'))
 
         # init queues for workers
-        self.filtered_tender_ids_queue = Queue(maxsize=buffers_size)  # queue of tender IDs with appropriate status
+        # queue of tender IDs with appropriate status, forward sync tenders are served first
+        self.filtered_tender_ids_queue = TenderQueue(maxsize=buffers_size, backfill_share=self.backfill_share)
         self.edrpou_codes_queue = Queue(maxsize=buffers_size)  # queue with edrpou codes (XmlData objects stored in it)
         self.reference_queue = Queue(maxsize=buffers_size)  # queue of request IDs and documents
         self.upload_to_api_queue = Queue(maxsize=buffers_size)  # queue with data to upload back into central DB
@@ -90,9 +119,13 @@ class EdrDataBridge(object):
         self.services_not_available = event.Event()
         self.services_not_available.set()
         self.db = Db(config)
-        self.process_tracker = ProcessTracker(self.db, self.time_to_live)
+        self.process_tracker = ProcessTracker(self.db, self.time_to_live, self.time_to_live_date_modified,
+                                              self.time_to_live_processed)
         self.request_db = RequestsDb(self.db, self.time_range)
+        self.request_db.migrate_code_indexes()
+        self.sfs_quota = SfsQuota(self.request_db, self.sfs_daily_quota)
         self.request_to_sfs = RequestsToSfs()
+        self.dedup_filter = DedupFilter(self.dedup_capacity, self.dedup_window)
 
         # Workers
         self.scanner = partial(Scanner.spawn,
@@ -101,7 +134,17 @@ class EdrDataBridge(object):
                                services_not_available=self.services_not_available,
                                process_tracker=self.process_tracker,
                                sleep_change_value=self.sleep_change_value,
-                               delay=self.delay)
+                               delay=self.delay,
+                               db=self.db,
+                               full_resync=self.full_resync,
+                               backward_shards=self.backward_shards,
+                               backward_pool_size=self.backward_pool_size,
+                               backward_history_days=self.backward_history_days,
+                               full_stack_sync_delay=self.full_stack_sync_delay,
+                               empty_stack_sync_delay=self.empty_stack_sync_delay,
+                               on_error_sleep_delay=self.on_error_sleep_delay,
+                               prefetch_pages=self.feed_prefetch_pages,
+                               dedup_filter=self.dedup_filter)
 
         self.filter_tender = partial(FilterTenders.spawn,
                                      tenders_sync_client=self.tenders_sync_client,
@@ -110,7 +153,11 @@ class EdrDataBridge(object):
                                      process_tracker=self.process_tracker,
                                      services_not_available=self.services_not_available,
                                      sleep_change_value=self.sleep_change_value,
-                                     delay=self.delay)
+                                     delay=self.delay,
+                                     pool_size=self.filter_pool_size,
+                                     awards_only=self.fetch_awards_only,
+                                     db=self.db,
+                                     validators_ttl=self.time_to_live_validators)
 
         self.sfs_reqs_worker = partial(SfsWorker.spawn, sfs_client=self.request_to_sfs,
                                        sfs_reqs_queue=self.edrpou_codes_queue,
@@ -119,7 +166,9 @@ class EdrDataBridge(object):
                                        redis_db=self.request_db,
                                        services_not_available=self.services_not_available,
                                        sleep_change_value=self.sleep_change_value,
-                                       delay=15)
+                                       sfs_rate_limiter=self.sfs_rate_limiter,
+                                       pool_size=self.sfs_pool_size,
+                                       sfs_quota=self.sfs_quota)
 
         self.request_for_reference = partial(RequestForReference.spawn,
                                              reference_queue=self.reference_queue,
@@ -129,6 +178,13 @@ class EdrDataBridge(object):
                                              sleep_change_value=self.sleep_change_value,
                                              delay=self.delay)
 
+        self.requests_compactor = partial(RequestsCompactor.spawn,
+                                          requests_db=self.request_db,
+                                          services_not_available=self.services_not_available,
+                                          horizon=self.requests_retention,
+                                          batch_size=self.compaction_batch_size,
+                                          interval=self.compaction_interval)
+
         self.upload_file_to_doc_service = partial(UploadFileToDocService.spawn,
                                                   upload_to_doc_service_queue=self.reference_queue,
                                                   upload_to_tender_queue=self.upload_to_api_queue,
@@ -189,6 +245,7 @@ class EdrDataBridge(object):
                      'filter_tender': self.filter_tender(),
                      'sfs_reqs_worker': self.sfs_reqs_worker(),
                      'request_for_reference': self.request_for_reference(),
+                     'requests_compactor': self.requests_compactor(),
                      'upload_file_to_doc_service': self.upload_file_to_doc_service(),
                      'upload_file_to_tender': self.upload_file_to_tender()
                      }
@@ -212,11 +269,15 @@ class EdrDataBridge(object):
                     counter = 0
                     logger.info(
                         'Current state: Filtered tenders {}; Edrpou codes queue {}; References queue {};'
-                        'Upload to API queue: {}'.format(
+                        'Upload to API queue: {}; Duplicate tenders hit rate: {:.2%}; SFS requests today: {}/{}; '
+                        'SFS backlog: {}'.format(
                             self.filtered_tender_ids_queue.qsize(),
                             self.edrpou_codes_queue.qsize(),
                             self.reference_queue.qsize(),
-                            self.upload_to_api_queue.qsize()))
+                            self.upload_to_api_queue.qsize(),
+                            self.dedup_filter.hit_rate(),
+                            self.sfs_quota.used(), self.sfs_daily_quota,
+                            self.request_db.backlog_size()))
                 counter += 1
                 self.check_and_revive_jobs()
         except KeyboardInterrupt:
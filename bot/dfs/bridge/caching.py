@@ -15,45 +15,123 @@ class Db(object):
         self._db_name = None
         self._port = None
         self._host = None
-        if 'cache_host' in self.config.get('main'):
+        self._sharding = None
+        # the embedded store serves deployments which configure no cache server
+        backend = self.config_get('cache_backend') or ('redis' if 'cache_host' in self.config.get('main') else 'sqlite')
+        if backend == 'redis':
             import redis
             self._backend = "redis"
             self._host = self.config_get('cache_host')
             self._port = self.config_get('cache_port') or 6379
             self._db_name = self.config_get('cache_db_name') or 0
-            self.db = redis.StrictRedis(host=self._host, port=self._port, db=self._db_name)
+            if self.config_get('cache_cluster'):
+                from rediscluster import StrictRedisCluster
+                self._sharding = "cluster"
+                options = self.pool_options()
+                del options['timeout']
+                self.db = StrictRedisCluster(startup_nodes=[{'host': self._host, 'port': self._port}],
+                                             skip_full_coverage_check=True, **options)
+            elif self.config_get('cache_nodes'):
+                from sharding import ShardedRedis
+                self._sharding = "client"
+                self.pools = [redis.BlockingConnectionPool(host=host, port=port, db=db, **self.pool_options())
+                              for host, port, db in self.cache_nodes()]
+                self.db = ShardedRedis([redis.StrictRedis(connection_pool=pool) for pool in self.pools])
+            else:
+                self.pool = redis.BlockingConnectionPool(host=self._host, port=self._port, db=self._db_name,
+                                                         **self.pool_options())
+                self.db = redis.StrictRedis(connection_pool=self.pool)
+            self.get_value = self.db.get
             self.set_value = self.db.set
             self.has_value = self.db.exists
             self.remove_value = self.db.delete
             LOGGER.info("Cache initialized")
+        elif backend == 'sqlite':
+            from embedded import SqliteStore, ThreadedStore
+            self._backend = "sqlite"
+            self._db_name = self.config_get('cache_path') or 'dfs_bot.sqlite'
+            self.db = ThreadedStore(SqliteStore(self._db_name))
+            self.get_value = self.db.get
+            self.set_value = self.db.set
+            self.has_value = self.db.exists
+            self.remove_value = self.db.delete
+            LOGGER.info("Embedded cache initialized in {}".format(self._db_name))
         else:
-            self.set_value = lambda x, y, z: None
-            self.has_value = lambda x: None
-            self.remove_value = lambda x: None
+            raise ValueError("Unknown cache_backend {}, expected redis or sqlite".format(backend))
+
+    @property
+    def sharded(self):
+        """Keys are spread over several nodes, so a script or transaction may only use keys of one hash slot"""
+        return self._sharding is not None
 
     def config_get(self, name):
         return self.config.get('main').get(name)
 
+    def pool_options(self):
+        """Connection pool settings; greenlets wait up to cache_pool_timeout for a free connection when all
+        cache_max_connections are in use. hiredis parser is used if installed unless cache_hiredis is false"""
+        from redis.connection import HIREDIS_AVAILABLE, HiredisParser, PythonParser
+        use_hiredis = self.config_get('cache_hiredis') is not False and HIREDIS_AVAILABLE
+        return {'max_connections': self.config_get('cache_max_connections') or 50,
+                'timeout': self.config_get('cache_pool_timeout') or 20,
+                'socket_timeout': self.config_get('cache_socket_timeout') or 5,
+                'socket_connect_timeout': self.config_get('cache_socket_connect_timeout') or 5,
+                'socket_keepalive': self.config_get('cache_socket_keepalive') is not False,
+                'parser_class': HiredisParser if use_hiredis else PythonParser}
+
+    def cache_nodes(self):
+        """(host, port, db) of every node listed in cache_nodes as comma separated host:port/db"""
+        nodes = []
+        for node in self.config_get('cache_nodes').split(','):
+            address, _, db = node.strip().partition('/')
+            host, _, port = address.partition(':')
+            nodes.append((host, int(port or 6379), int(db or 0)))
+        return nodes
+
     def get(self, key):
-        LOGGER.info("Getting item {} from the cache".format(key))
-        return self.db.get(key)
+        LOGGER.debug("Getting item %s from the cache", key)
+        return self.get_value(key)
 
     def put(self, key, value, ex=86400):
-        LOGGER.info("Saving key {} to cache".format(key))
+        LOGGER.debug("Saving key %s to cache", key)
         self.set_value(key, value, ex)
 
     def remove(self, key):
         self.remove_value(key)
 
     def has(self, key):
-        LOGGER.info("Checking if code {} is in the cache".format(key))
+        LOGGER.debug("Checking if code %s is in the cache", key)
         return self.has_value(key)
 
+    def set(self, key, value, ex=None, nx=False):
+        return self.db.set(key, value, ex=ex, nx=nx)
+
+    def pipeline(self, transaction=True):
+        """Commands queued on the pipeline are sent in one round trip, wrapped in MULTI/EXEC if transaction. Redis
+        Cluster pipelines can't be transactional and sharded ones are transactional only per node"""
+        return self.db.pipeline(transaction and self._sharding != "cluster")
+
+    def register_script(self, script, implementation=None):
+        """Redis runs the Lua script; the embedded store runs its Python implementation, which takes the store, keys
+        and args, in one transaction"""
+        if self._backend == "sqlite":
+            return self.db.register_script(script, implementation)
+        return self.db.register_script(script)
+
     def hgetall(self, key):
         return self.db.hgetall(key)
 
+    def hget(self, key, field):
+        return self.db.hget(key, field)
+
+    def scan_iter(self, match=None, count=None):
+        return self.db.scan_iter(match, count=count)
+
     def smembers(self, key):
-        return self.db.smembers(key) if self.db.keys(key) else []
+        return self.db.smembers(key)
+
+    def sscan_iter(self, key, count=None):
+        return self.db.sscan_iter(key, count=count)
 
     def sadd(self, key, value):
         return self.db.sadd(key, value)
@@ -67,15 +145,44 @@ class Db(object):
     def hset(self, key, field, value):
         self.db.hset(key, field, value)
 
+    def incr(self, key):
+        return self.db.incr(key)
+
+    def decr(self, key):
+        return self.db.decr(key)
+
+    def expire(self, key, ex):
+        return self.db.expire(key, ex)
+
+    def rpush(self, key, value):
+        return self.db.rpush(key, value)
+
+    def lpop(self, key):
+        return self.db.lpop(key)
+
+    def llen(self, key):
+        return self.db.llen(key)
+
     def zadd(self, name, *args, **kwargs):
         return self.db.zadd(name, *args, **kwargs)
 
-    def zinterstore(self, name, sets):
-        return self.db.zinterstore(name, sets, aggregate="MAX")
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        return self.db.zrangebyscore(name, min, max, start, num)
 
-    def zrangebyscore(self, name, min, max):
-        return self.db.zrangebyscore(name, min, max)
+    def zscore(self, name, value):
+        return self.db.zscore(name, value)
+
+    def zscan_iter(self, name, count=None):
+        return self.db.zscan_iter(name, count=count)
 
 
 def db_key(tender_id):
     return "{}".format(tender_id)
+
+
+def date_modified_key(tender_id):
+    return "date_modified:{}".format(tender_id)
+
+
+def processed_key(item_key):
+    return "processed:{}".format(item_key)
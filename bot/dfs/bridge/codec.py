@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+from importlib import import_module
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+FAST_BACKENDS = ('ujson', 'rapidjson')
+
+
+def load_backend(name=None):
+    """Return name, loads and dumps of the given JSON library, or of the fastest one installed if no name is given,
+    simplejson if there is none; ImportError is raised if the given library is not installed. dumps of every library
+    escapes non-ASCII characters, so it always returns ASCII str which is stored as is"""
+    if name is not None:
+        module = import_module(name)
+        return name, module.loads, partial(module.dumps, ensure_ascii=True)
+    for name in FAST_BACKENDS:
+        try:
+            return load_backend(name)
+        except ImportError:
+            continue
+    from simplejson import dumps, loads
+    return 'simplejson', loads, partial(dumps, ensure_ascii=True)
+
+
+def installed_backends():
+    """load_backend result for every JSON library installed, simplejson included"""
+    for name in FAST_BACKENDS + ('simplejson',):
+        try:
+            yield load_backend(name)
+        except ImportError:
+            continue
+
+backend, loads, dumps = load_backend()
+LOGGER.info("Using {} for JSON".format(backend))
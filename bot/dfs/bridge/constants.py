@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+from datetime import time
 
 from pytz import timezone
 
@@ -19,5 +20,6 @@ FORM_NAME = "Jxxxxxxx"
 qualification_procurementMethodType = ('aboveThresholdUA', 'aboveThresholdUA.defense', 'aboveThresholdEU',
                                        'competitiveDialogueUA.stage2', 'competitiveDialogueEU.stage2')
 HOLIDAYS_FILE = 'working_days.json'
+WORKING_HOURS = (time(9, 0), time(18, 0))
 TZ = timezone(os.environ['TZ'] if 'TZ' in os.environ else 'Europe/Kiev')
 file_name = "sfs_reference.yaml"
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from bot.dfs.bridge.utils import is_code_valid, is_passport_valid, is_vatin_valid
 from constants import id_passport_len
-from simplejson import dumps
+from bot.dfs.bridge.codec import dumps
 
 
 class Data(object):
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from time import time
+
+
+class DedupFilter(object):
+    """Remembers at most capacity keys, each of them for window seconds since it was added; the least recently seen
+    key is evicted to make room for a new one"""
+
+    def __init__(self, capacity=50000, window=3600):
+        self.capacity = capacity
+        self.window = window
+        self._items = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+
+    def seen(self, key):
+        """Return True if key was added within window and make it the most recently seen, remember it otherwise.
+        Keys past window are dropped when they are looked up or evicted"""
+        now = time()
+        self.lookups += 1
+        added = self._items.pop(key, None)
+        if added is not None and now - added < self.window:
+            self.hits += 1
+            self._items[key] = added
+            return True
+        self._items[key] = now
+        if len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+        return False
+
+    def hit_rate(self):
+        return float(self.hits) / self.lookups if self.lookups else 0.0
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from time import time
+
+from gevent.threadpool import ThreadPool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS hashes (key TEXT, field TEXT, value TEXT, PRIMARY KEY (key, field));
+CREATE TABLE IF NOT EXISTS sets (key TEXT, member TEXT, PRIMARY KEY (key, member));
+CREATE TABLE IF NOT EXISTS zsets (key TEXT, member TEXT, score REAL, PRIMARY KEY (key, member));
+CREATE INDEX IF NOT EXISTS zsets_score ON zsets (key, score, member);
+CREATE TABLE IF NOT EXISTS lists (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS lists_key ON lists (key, id);
+CREATE TABLE IF NOT EXISTS expires (key TEXT PRIMARY KEY, at REAL);
+CREATE INDEX IF NOT EXISTS expires_at ON expires (at);
+"""
+TABLES = ("strings", "hashes", "sets", "zsets", "lists")
+
+
+class SqliteStore(object):
+    """Embedded replacement for the subset of redis.StrictRedis used by the bridge, kept in an SQLite database in
+    WAL mode. Keys with a TTL are removed when they are read, and all expired keys are purged by the first write
+    transaction after every purge_interval seconds, so keys which are never read again don't pile up. Scripts can't
+    be run, so register_script takes a Python implementation of the script which is run in one transaction.
+    Queries block the calling thread, see ThreadedStore"""
+
+    def __init__(self, path, purge_interval=60):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._purged = 0
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.text_factory = str
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self):
+        if self._depth == 0:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if time() - self._purged >= self.purge_interval:
+                self._purge()
+        self._depth += 1
+        try:
+            yield
+        except Exception:
+            self._depth -= 1
+            if self._depth == 0:
+                self.connection.execute("ROLLBACK")
+            raise
+        else:
+            self._depth -= 1
+            if self._depth == 0:
+                self.connection.execute("COMMIT")
+
+    def _query(self, sql, *params):
+        return self.connection.execute(sql, params).fetchall()
+
+    def _alive(self, key):
+        """Drop the key if its TTL is over"""
+        if self._query("SELECT 1 FROM expires WHERE key = ? AND at <= ?", key, time()):
+            self._delete(key)
+
+    def _purge(self):
+        self._purged = now = time()
+        for table in TABLES:
+            self.connection.execute("DELETE FROM {} WHERE key IN (SELECT key FROM expires WHERE at <= ?)".format(table),
+                                    (now,))
+        self.connection.execute("DELETE FROM expires WHERE at <= ?", (now,))
+
+    def _delete(self, key):
+        deleted = 0
+        for table in TABLES:
+            deleted += self.connection.execute("DELETE FROM {} WHERE key = ?".format(table), (key,)).rowcount
+        self.connection.execute("DELETE FROM expires WHERE key = ?", (key,))
+        return deleted > 0
+
+    # keys
+    def exists(self, key):
+        self._alive(key)
+        return any(self._query("SELECT 1 FROM {} WHERE key = ? LIMIT 1".format(table), key) for table in TABLES)
+
+    def delete(self, *keys):
+        with self.transaction():
+            return sum(self._delete(key) for key in keys)
+
+    def expire(self, key, seconds):
+        if not self.exists(key):
+            return False
+        self._query("INSERT OR REPLACE INTO expires (key, at) VALUES (?, ?)", key, time() + seconds)
+        return True
+
+    def ttl(self, key):
+        if not self.exists(key):
+            return -2
+        rows = self._query("SELECT at FROM expires WHERE key = ?", key)
+        return int(round(rows[0][0] - time())) if rows else -1
+
+    def scan_iter(self, match=None, count=None):
+        keys = set()
+        for table in TABLES:
+            keys.update(key for key, in self._query("SELECT DISTINCT key FROM {}".format(table)))
+        for key in sorted(keys):
+            if (match is None or fnmatchcase(key, match)) and self.exists(key):
+                yield key
+
+    def flushall(self):
+        with self.transaction():
+            for table in TABLES + ("expires",):
+                self.connection.execute("DELETE FROM {}".format(table))
+
+    # strings
+    def get(self, key):
+        self._alive(key)
+        rows = self._query("SELECT value FROM strings WHERE key = ?", key)
+        return rows[0][0] if rows else None
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.transaction():
+            if nx and self.exists(key):
+                return None
+            self._delete(key)
+            self._query("INSERT INTO strings (key, value) VALUES (?, ?)", key, encode(value))
+            if ex:
+                self.expire(key, ex)
+            return True
+
+    def incr(self, key, amount=1):
+        with self.transaction():
+            value = int(self.get(key) or 0) + amount
+            self._query("INSERT OR REPLACE INTO strings (key, value) VALUES (?, ?)", key, str(value))
+            return value
+
+    def decr(self, key, amount=1):
+        return self.incr(key, -amount)
+
+    # hashes
+    def hget(self, key, field):
+        self._alive(key)
+        rows = self._query("SELECT value FROM hashes WHERE key = ? AND field = ?", key, encode(field))
+        return rows[0][0] if rows else None
+
+    def hgetall(self, key):
+        self._alive(key)
+        return dict(self._query("SELECT field, value FROM hashes WHERE key = ?", key))
+
+    def hset(self, key, field, value):
+        with self.transaction():
+            self._alive(key)
+            new = not self._query("SELECT 1 FROM hashes WHERE key = ? AND field = ?", key, encode(field))
+            self._query("INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                        key, encode(field), encode(value))
+            return int(new)
+
+    def hmget(self, key, fields):
+        return [self.hget(key, field) for field in fields]
+
+    def hdel(self, key, *fields):
+        with self.transaction():
+            return sum(self.connection.execute("DELETE FROM hashes WHERE key = ? AND field = ?",
+                                               (key, encode(field))).rowcount for field in fields)
+
+    def hmset(self, key, mapping):
+        with self.transaction():
+            for field, value in mapping.items():
+                self.hset(key, field, value)
+            return True
+
+    # sets
+    def sadd(self, key, *members):
+        with self.transaction():
+            self._alive(key)
+            return sum(self.connection.execute("INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)",
+                                               (key, encode(member))).rowcount for member in members)
+
+    def srem(self, key, *members):
+        with self.transaction():
+            return sum(self.connection.execute("DELETE FROM sets WHERE key = ? AND member = ?",
+                                               (key, encode(member))).rowcount for member in members)
+
+    def smembers(self, key):
+        self._alive(key)
+        return {member for member, in self._query("SELECT member FROM sets WHERE key = ?", key)}
+
+    def sismember(self, key, member):
+        self._alive(key)
+        return bool(self._query("SELECT 1 FROM sets WHERE key = ? AND member = ?", key, encode(member)))
+
+    def sscan_iter(self, key, match=None, count=None):
+        for member in sorted(self.smembers(key)):
+            if match is None or fnmatchcase(member, match):
+                yield member
+
+    # sorted sets
+    def zadd(self, key, *args):
+        """Takes score1, member1, score2, member2, ... like StrictRedis.zadd"""
+        with self.transaction():
+            self._alive(key)
+            added = 0
+            for score, member in zip(args[::2], args[1::2]):
+                added += not self._query("SELECT 1 FROM zsets WHERE key = ? AND member = ?", key, encode(member))
+                self._query("INSERT OR REPLACE INTO zsets (key, member, score) VALUES (?, ?, ?)",
+                            key, encode(member), float(score))
+            return added
+
+    def zrem(self, key, *members):
+        with self.transaction():
+            return sum(self.connection.execute("DELETE FROM zsets WHERE key = ? AND member = ?",
+                                               (key, encode(member))).rowcount for member in members)
+
+    def zscore(self, key, member):
+        self._alive(key)
+        rows = self._query("SELECT score FROM zsets WHERE key = ? AND member = ?", key, encode(member))
+        return rows[0][0] if rows else None
+
+    def zrangebyscore(self, key, min, max, start=None, num=None, withscores=False):
+        self._alive(key)
+        sql = "SELECT member, score FROM zsets WHERE key = ? AND score >= ? AND score <= ? ORDER BY score, member"
+        params = [key, float(min), float(max)]
+        if start is not None and num is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [num, start]
+        rows = self._query(sql, *params)
+        return rows if withscores else [member for member, _ in rows]
+
+    def zrangebylex(self, key, min, max):
+        """Takes bounds like "[a" (inclusive), "(a" (exclusive), "-" and "+"; members compare as bytes"""
+        self._alive(key)
+        sql, params = "SELECT member FROM zsets WHERE key = ?", [key]
+        for bound, operators in ((min, (">=", ">")), (max, ("<=", "<"))):
+            if bound not in ("-", "+"):
+                sql += " AND member {} ?".format(operators[bound[0] == "("])
+                params.append(encode(bound[1:]))
+        return [member for member, in self._query(sql + " ORDER BY member", *params)]
+
+    def zcard(self, key):
+        self._alive(key)
+        return self._query("SELECT COUNT(*) FROM zsets WHERE key = ?", key)[0][0]
+
+    def zrange(self, key, start, end, withscores=False):
+        rows = self.zrangebyscore(key, "-inf", "+inf", withscores=True)
+        rows = rows[start:] if end == -1 else rows[start:end + 1]
+        return rows if withscores else [member for member, _ in rows]
+
+    def zscan_iter(self, key, match=None, count=None):
+        for member, score in self.zrangebyscore(key, "-inf", "+inf", withscores=True):
+            if match is None or fnmatchcase(member, match):
+                yield member, score
+
+    # lists
+    def rpush(self, key, *values):
+        with self.transaction():
+            self._alive(key)
+            for value in values:
+                self._query("INSERT INTO lists (key, value) VALUES (?, ?)", key, encode(value))
+            return self.llen(key)
+
+    def lpop(self, key):
+        with self.transaction():
+            self._alive(key)
+            rows = self._query("SELECT id, value FROM lists WHERE key = ? ORDER BY id LIMIT 1", key)
+            if not rows:
+                return None
+            self._query("DELETE FROM lists WHERE id = ?", rows[0][0])
+            return rows[0][1]
+
+    def llen(self, key):
+        self._alive(key)
+        return self._query("SELECT COUNT(*) FROM lists WHERE key = ?", key)[0][0]
+
+    # batching
+    def pipeline(self, transaction=True):
+        return SqlitePipeline(self)
+
+    def register_script(self, script, implementation):
+        def run(keys=[], args=[]):
+            with self.transaction():
+                return implementation(self, keys, args)
+
+        return run
+
+    def execute_command(self, *args):
+        raise ValueError("Command {} is not supported by the embedded store".format(args[0]))
+
+
+class ThreadedStore(object):
+    """Runs every call of the store in one native thread of gevent's threadpool, so that SQLite queries and fsyncs
+    don't block other greenlets. Calls are served one at a time, which keeps transactions of pipelines and scripts
+    whole; scan iterators are read out in the thread"""
+
+    def __init__(self, store):
+        self.store = store
+        self.pool = ThreadPool(1)
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if name.endswith("scan_iter"):
+            return lambda *args, **kwargs: iter(self.pool.apply(lambda: list(method(*args, **kwargs))))
+        return lambda *args, **kwargs: self.pool.apply(method, args, kwargs)
+
+    def pipeline(self, transaction=True):
+        return ThreadedPipeline(self, self.store.pipeline(transaction))
+
+    def register_script(self, script, implementation):
+        run = self.store.register_script(script, implementation)
+        return lambda keys=[], args=[]: self.pool.apply(run, (), {"keys": keys, "args": args})
+
+
+class ThreadedPipeline(object):
+    """Pipeline of ThreadedStore, executed in the thread of the store"""
+
+    def __init__(self, threaded, pipe):
+        self.threaded = threaded
+        self.pipe = pipe
+
+    def __getattr__(self, name):
+        queue = getattr(self.pipe, name)
+
+        def queued(*args, **kwargs):
+            queue(*args, **kwargs)
+            return self
+
+        return queued
+
+    def execute(self, raise_on_error=True):
+        return self.threaded.pool.apply(self.pipe.execute, (raise_on_error,))
+
+
+class SqlitePipeline(object):
+    """Queues commands and runs them in one transaction on execute, like a redis pipeline"""
+
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self, raise_on_error=True):
+        commands, self.commands = self.commands, []
+        results = []
+        with self.store.transaction():
+            for method, args, kwargs in commands:
+                try:
+                    results.append(method(*args, **kwargs))
+                except Exception as e:
+                    if raise_on_error:
+                        raise
+                    results.append(e)
+        return results
+
+
+def encode(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
@@ -2,17 +2,21 @@
 import pickle
 from datetime import datetime
 
-from caching import db_key
+from caching import db_key, date_modified_key, processed_key
 from utils import item_key
 
 
 class ProcessTracker(object):
-    def __init__(self, db=None, ttl=300):
+    def __init__(self, db=None, ttl=300, date_modified_ttl=2592000, processed_ttl=2592000):
         self.processing_items = {}
         self.processed_items = {}
         self._db = db
         self.tender_documents_to_process = {}
+        self.scheduled_tenders = {}
+        self.tender_validators = {}
         self.ttl = ttl
+        self.date_modified_ttl = date_modified_ttl
+        self.processed_ttl = processed_ttl
 
     def set_item(self, tender_id, award_id, docs_amount=0):
         self.processing_items[item_key(tender_id, award_id)] = docs_amount
@@ -36,12 +40,45 @@ class ProcessTracker(object):
         return item_key(tender_id, award_id) in self.processing_items.keys()
 
     def check_processed_item(self, tender_id, award_id):
-        """Check if current tender_id, award_id was already processed"""
-        return item_key(tender_id, award_id) in self.processed_items.keys()
+        """Check if current tender_id, award_id was already processed, including by previous runs"""
+        key = item_key(tender_id, award_id)
+        return key in self.processed_items or bool(self._db is not None and self._db.has(processed_key(key)))
+
+    def check_tender_in_process(self, tender_id):
+        prefix = item_key(tender_id, '')
+        return any(key.startswith(prefix) for key in self.processing_items)
+
+    def set_tender_validators(self, tender_id, key, validators, ttl):
+        """Validators are saved only when every award of the tender is processed, otherwise after restart the tender
+        would be answered with 304 and its unprocessed awards would be lost"""
+        if self.check_tender_in_process(tender_id):
+            self.tender_validators[tender_id] = (key, validators, ttl)
+        elif self._db is not None:
+            self._db.put(key, validators, ttl)
 
     def check_processed_tenders(self, tender_id):
         return self._db.has(db_key(tender_id)) or False
 
+    def schedule_tender(self, tender_id, date_modified):
+        """Remember dateModified the tender had in feed until it is fetched"""
+        self.scheduled_tenders[tender_id] = date_modified
+
+    def set_tender_fetched(self, tender_id, date_modified=None):
+        """Save dateModified of the fetched tender version, feed value is used if tender has none"""
+        scheduled_date_modified = self.scheduled_tenders.pop(tender_id, None)
+        date_modified = date_modified or scheduled_date_modified
+        if date_modified and self._db is not None:
+            self._db.put(date_modified_key(tender_id), date_modified, self.date_modified_ttl)
+        return date_modified
+
+    def unschedule_tender(self, tender_id):
+        """Forget the feed dateModified of the tender which is not going to be fetched"""
+        self.scheduled_tenders.pop(tender_id, None)
+
+    def check_tender_modified(self, tender_id, date_modified):
+        """Check if tender was modified since it was fetched last time"""
+        return not (date_modified and self._db.get(date_modified_key(tender_id)) == date_modified)
+
     def get_unprocessed_items(self):
         return self._db.get_items("unprocessed_*") or []
 
@@ -57,9 +94,12 @@ class ProcessTracker(object):
             self.processing_items[key] -= 1
         else:
             self.processed_items[key] = datetime.now()
+            self._db.put(processed_key(key), self.processed_items[key].isoformat(), self.processed_ttl)
             self._remove_unprocessed_item(document_id)
             del self.processing_items[key]
 
     def update_items_and_tender(self, tender_id, award_id, document_id):
         self._update_processing_items(tender_id, award_id, document_id)
         self._remove_docs_amount_from_tender(tender_id)
+        if tender_id in self.tender_validators and not self.check_tender_in_process(tender_id):
+            self._db.put(*self.tender_validators.pop(tender_id))
@@ -1,8 +1,122 @@
 # coding=utf-8
 from time import time
 
+from bot.dfs.bridge.codec import loads
 from bot.dfs.bridge.data import Data
-from simplejson import loads
+
+DAILY_REQUESTS_TTL = 2 * 24 * 60 * 60
+INDEX_VERSION = 1
+INDEX_VERSION_KEY = "requests:index_version"
+# zsets of codes scored by the last time a request was registered for them, one of all codes which have requests and
+# one of codes which may have pending requests; codes are dropped from them once they have none
+CODES_KEY = "requests:codes"
+PENDING_CODES_KEY = "requests:codes:pending"
+# how long a code without pending requests stays in PENDING_CODES_KEY after a request was registered for it, so that a
+# request which is indexed by its code but is not written yet is not missed
+PENDING_CODES_GRACE = 600
+
+# Requests of a code and the awards bound to them live in keys which carry the code as a {hash tag}, so scripts over
+# them run on a single shard. Every script takes these keys of the code first: complete index, dates index, pending
+# set, awards index (members request_id:tender_id:award_id), award owners and award data (both with fields
+# tender_id:award_id).
+# FIND_OR_CREATE_SCRIPT KEYS: the code's keys, hash of the new request, then on a single node also the code indexes
+# and the day's counter if quota is enforced; ARGV: now, start of recent range, new request ID, 1 to register the new
+# request if no recent one is found, code, tender ID, award ID, name, award data, allowance, counter TTL, award data
+# with the new request among its sourceRequests, saved instead if the award registers the request
+FIND_OR_CREATE_SCRIPT = """
+local found, status
+for i, index in ipairs({KEYS[1], KEYS[2]}) do
+    found = redis.call('ZRANGEBYSCORE', index, ARGV[2], ARGV[1], 'LIMIT', 0, 1)[1]
+    if found then
+        status = i == 1 and 'complete' or 'pending'
+        break
+    end
+end
+if not found then
+    if ARGV[4] ~= '1' then
+        return {'', 'missing'}
+    end
+    if KEYS[8] then
+        if KEYS[10] then
+            if tonumber(redis.call('GET', KEYS[10]) or 0) >= tonumber(ARGV[10]) then
+                return {'', 'quota'}
+            end
+            redis.call('INCR', KEYS[10])
+            redis.call('EXPIRE', KEYS[10], ARGV[11])
+        end
+        redis.call('ZADD', KEYS[8], ARGV[1], ARGV[5])
+        redis.call('ZADD', KEYS[9], ARGV[1], ARGV[5])
+    end
+    redis.call('HMSET', KEYS[7], 'code', ARGV[5], 'tender_id', ARGV[6], 'name', ARGV[8], 'response', 'placeholder')
+    redis.call('ZADD', KEYS[2], ARGV[1], ARGV[3])
+    redis.call('SADD', KEYS[3], ARGV[3])
+    found, status = ARGV[3], 'new'
+end
+local award = ARGV[6] .. ':' .. ARGV[7]
+redis.call('ZADD', KEYS[4], 0, found .. ':' .. award)
+redis.call('HSET', KEYS[5], award, found)
+redis.call('HSET', KEYS[6], award, status == 'new' and ARGV[12] or ARGV[9])
+return {found, status}
+"""
+
+# KEYS: the code's keys, hash of the request; ARGV: request ID, now
+COMPLETE_SCRIPT = """
+local created = redis.call('ZSCORE', KEYS[2], ARGV[1]) or ARGV[2]
+redis.call('ZADD', KEYS[1], created, ARGV[1])
+redis.call('SREM', KEYS[3], ARGV[1])
+redis.call('HSET', KEYS[7], 'status', 'complete')
+"""
+
+# KEYS: the code's keys, hashes of the requests; ARGV: IDs of the requests. Returns the numbers of removed request
+# hashes, of those which were pending and of removed award bindings, their size in bytes and the number of requests
+# the code has left
+EXPIRE_SCRIPT = """
+local requests, pending, bindings, size = 0, 0, 0, 0
+for i, request_id in ipairs(ARGV) do
+    for _, value in ipairs(redis.call('HGETALL', KEYS[6 + i])) do
+        size = size + #value
+    end
+    requests = requests + redis.call('DEL', KEYS[6 + i])
+    redis.call('ZREM', KEYS[1], request_id)
+    redis.call('ZREM', KEYS[2], request_id)
+    pending = pending + redis.call('SREM', KEYS[3], request_id)
+    for _, member in ipairs(redis.call('ZRANGEBYLEX', KEYS[4], '[' .. request_id .. ':', '(' .. request_id .. ';')) do
+        local award = string.sub(member, #request_id + 2)
+        redis.call('ZREM', KEYS[4], member)
+        bindings, size = bindings + 1, size + #member
+        if redis.call('HGET', KEYS[5], award) == request_id then
+            size = size + #award * 2 + #request_id + #(redis.call('HGET', KEYS[6], award) or '')
+            redis.call('HDEL', KEYS[5], award)
+            redis.call('HDEL', KEYS[6], award)
+        end
+    end
+end
+return {requests, pending, bindings, size, redis.call('ZCARD', KEYS[2])}
+"""
+
+# KEYS: the code's awards index and award data; ARGV: request ID. Returns data of the awards bound to the request
+TENDERS_OF_SCRIPT = """
+local fields, dumps = {}, {}
+for i, member in ipairs(redis.call('ZRANGEBYLEX', KEYS[1], '[' .. ARGV[1] .. ':', '(' .. ARGV[1] .. ';')) do
+    fields[i] = string.sub(member, #ARGV[1] + 2)
+end
+-- unpack takes a bounded number of values
+for start = 1, #fields, 1000 do
+    for _, dump in ipairs(redis.call('HMGET', KEYS[2], unpack(fields, start, math.min(start + 999, #fields)))) do
+        dumps[#dumps + 1] = dump
+    end
+end
+return dumps
+"""
+
+# KEYS: index; ARGV: member, its score when it was found stale. Removes the member unless it was touched since
+REMOVE_STALE_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score and tonumber(score) == tonumber(ARGV[2]) then
+    return redis.call('ZREM', KEYS[1], ARGV[1])
+end
+return 0
+"""
 
 
 class RequestsDb(object):
@@ -10,64 +124,430 @@ class RequestsDb(object):
 
     def __init__(self, db, time_range=1000):
         super(RequestsDb, self).__init__()
-        self.time_range = time_range
+        # an empty range would never find the request just registered for the code, so every award would make its own
+        self.time_range = max(time_range, 1)
         self._db = db
+        self._find_or_create = db.register_script(FIND_OR_CREATE_SCRIPT, find_or_create)
+        self._complete = db.register_script(COMPLETE_SCRIPT, complete)
+        self._expire = db.register_script(EXPIRE_SCRIPT, expire)
+        self._remove_stale = db.register_script(REMOVE_STALE_SCRIPT, remove_stale)
+        self._tenders_of = db.register_script(TENDERS_OF_SCRIPT, tenders_of)
 
     def add_sfs_request(self, request_id, request_data):
-        self._db.hmset(req_key(request_id), request_data)
-        self._db.sadd("requests:pending", request_id)
-        self._db.sadd("requests:edrpou:{}".format(request_data['code']), request_id)
-        self._db.zadd("requests:dates", time(), request_id)
+        now = time()
+        code = request_data['code']
+        pipe = self._db.pipeline()
+        pipe.zadd(CODES_KEY, now, code)
+        pipe.zadd(PENDING_CODES_KEY, now, code)
+        pipe.hmset(request_key(code, request_id), request_data)
+        pipe.sadd(code_pending_key(code), request_id)
+        pipe.zadd(code_dates_key(code), now, request_id)
+        pipe.execute()
 
     def get_pending_requests(self):
-        return {key: self.get_request(key) for key in self._db.smembers("requests:pending")}
+        return dict(self.iter_pending_requests())
+
+    def iter_pending_requests(self, batch_size=100):
+        """Walk codes which may have pending requests batch_size codes at a time, reading their pending sets in one
+        pipeline and data of the requests in another; yields (request ID, request data) pairs. Codes left without
+        pending requests are dropped from the walk"""
+        batch = []
+        for entry in self._db.zscan_iter(PENDING_CODES_KEY, count=batch_size):
+            batch.append(entry)
+            if len(batch) == batch_size:
+                for pair in self._load_pending(batch):
+                    yield pair
+                batch = []
+        for pair in self._load_pending(batch):
+            yield pair
+
+    def _load_pending(self, codes):
+        if not codes:
+            return []
+        reads = self._db.pipeline(transaction=False)
+        for code, _ in codes:
+            reads.smembers(code_pending_key(code))
+        pending = reads.execute()
+        stale = time() - PENDING_CODES_GRACE
+        for (code, touched), request_ids in zip(codes, pending):
+            if not request_ids and touched < stale:
+                self._remove_stale(keys=[PENDING_CODES_KEY], args=[code, repr(touched)])
+        requests = [(code, request_id) for (code, _), request_ids in zip(codes, pending) for request_id in request_ids]
+        reads = self._db.pipeline(transaction=False)
+        for code, request_id in requests:
+            reads.hgetall(request_key(code, request_id))
+        return zip([request_id for _, request_id in requests], reads.execute()) if requests else []
 
-    def get_request(self, request_id):
-        return self._db.hgetall(req_key(request_id))
+    def get_request(self, request_id, code):
+        return self._db.hgetall(request_key(code, request_id))
 
-    def complete_request(self, request_id):
-        self._db.srem("requests:pending", request_id)
-        self._db.sadd("requests:complete", request_id)
-        self._db.hset(req_key(request_id), "status", "complete")
+    def complete_request(self, request_id, code):
+        self._complete(keys=code_keys(code) + [request_key(code, request_id)], args=[request_id, time()])
+
+    def cancel_request(self, request_id, code, day=None):
+        """Remove a request which could not be sent together with the awards bound to it, so that awards with its
+        code register a new one; the request is given back to the day's count if day is given"""
+        self._expire(keys=code_keys(code) + [request_key(code, request_id)], args=[request_id])
+        if day is not None:
+            self._db.decr(daily_key(day))
 
     def add_award(self, tender_id, award_id, request_id, data):
-        self._db.hmset(award_key(tender_id, award_id), {"request_id": request_id, "data": data.db_dump()})
-        # self._db.put(award_key(tender_id, award_id), request_id)
-        self._db.sadd("tenders_of:{}".format(request_id), award_key(tender_id, award_id))
+        award = award_field(tender_id, award_id)
+        pipe = self._db.pipeline()
+        pipe.zadd(code_awards_key(data.code), 0, "{}:{}".format(request_id, award))
+        pipe.hset(code_owners_key(data.code), award, request_id)
+        pipe.hset(code_award_data_key(data.code), award, data.db_dump())
+        pipe.execute()
 
     def recent_requests_with(self, code):
-        # if self._db.has("requests:dates") and self._db.has("request:edrpou"):
-        self._db.zinterstore("recent:requests:edrpou:{}".format(code), ("requests:edrpou:{}".format(code),
-                                                                        "requests:dates"))
-        return self._db.zrangebyscore("recent:requests:edrpou:{}".format(code), time() - self.time_range, time())
+        return self._db.zrangebyscore(code_dates_key(code), time() - self.time_range, time())
 
     def complete_requests_with(self, code):
-        return self._db.sinter("complete:requests:with", ("requests:edrpou:{}".format(code), "requests:complete"))
+        return self._db.zrangebyscore(code_complete_key(code), "-inf", "+inf")
 
     def recent_complete_requests_with(self, code):
-        self._db.zinterstore("recent:complete:edrpou:{}:".format(code), ("requests:edrpou:{}".format(code),
-                                                                         "requests:dates"))
-        return self._db.zrangebyscore("recent:complete:edrpou:{}:".format(code), time() - self.time_range, time())
+        return self._db.zrangebyscore(code_complete_key(code), time() - self.time_range, time())
+
+    def expire_requests(self, before, batch_size=100):
+        """Remove requests made before the given timestamp together with their awards and index entries. Codes are
+        walked batch_size at a time, looking their expired requests up in one pipeline, and requests of a code are
+        removed batch_size at a time by one script on its shard; yields (removed requests, how many of them were
+        still pending, removed award bindings, their size in bytes) for every such batch. Requests which are still
+        pending are removed too, SFS is not waited for past the horizon. Awards which were rebound to another request
+        are kept. Size counts field names and values, without the overhead of the server"""
+        batch = []
+        for entry in self._db.zscan_iter(CODES_KEY, count=batch_size):
+            batch.append(entry)
+            if len(batch) == batch_size:
+                for removed in self._expire_codes(batch, before, batch_size):
+                    yield removed
+                batch = []
+        for removed in self._expire_codes(batch, before, batch_size):
+            yield removed
+
+    def _expire_codes(self, codes, before, batch_size):
+        if not codes:
+            return
+        reads = self._db.pipeline(transaction=False)
+        for code, _ in codes:
+            reads.zrangebyscore(code_dates_key(code), "-inf", before, start=0, num=batch_size)
+            reads.zcard(code_dates_key(code))
+        results = reads.execute()
+        for (code, touched), request_ids, left in zip(codes, results[::2], results[1::2]):
+            while request_ids:
+                requests, pending, bindings, size, left = self._expire(
+                    keys=code_keys(code) + [request_key(code, request_id) for request_id in request_ids],
+                    args=request_ids)
+                yield requests, pending, bindings, size
+                request_ids = (self._db.zrangebyscore(code_dates_key(code), "-inf", before, start=0, num=batch_size)
+                               if left and len(request_ids) == batch_size else [])
+            # a request registered for the code meanwhile has moved its score past before
+            if not left and touched < before:
+                self._remove_stale(keys=[CODES_KEY], args=[code, repr(touched)])
+
+    def migrate_code_indexes(self, batch_size=1000):
+        """Move requests and their awards from the untagged keys they had before, requests:<id> hashes,
+        requests:dates, requests:pending, requests:complete, tenders_of:<id> sets and tender:<tender_id>:<award_id>
+        hashes, to the keys of their codes; does nothing if already done. requests:dates is walked batch_size
+        requests at a time, reading a batch in two pipelines and writing it in one. Old keys are dropped once
+        everything is written: those of the requests in requests:dates, the awards in their tenders_of sets and the
+        requests:edrpou:<code> sets and lookup results of their codes, so keys the migration did not read are kept.
+        Returns the number of migrated requests"""
+        if self._db.get(INDEX_VERSION_KEY) == str(INDEX_VERSION):
+            return 0
+        migrated = 0
+        for batch in self._legacy_batches(batch_size):
+            migrated += self._migrate_batch(batch)
+        # an interrupted migration is simply run again
+        for batch in self._legacy_batches(batch_size):
+            self._remove_legacy_keys(batch)
+        self._remove_keys(["requests:dates", "requests:pending", "requests:complete"])
+        self._db.set(INDEX_VERSION_KEY, INDEX_VERSION)
+        return migrated
+
+    def _legacy_batches(self, batch_size):
+        batch = []
+        for entry in self._db.zscan_iter("requests:dates", count=batch_size):
+            batch.append(entry)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _migrate_batch(self, batch):
+        if not batch:
+            return 0
+        reads = self._db.pipeline(transaction=False)
+        for request_id, _ in batch:
+            reads.hgetall(legacy_request_key(request_id))
+            reads.sismember("requests:complete", request_id)
+            reads.sismember("requests:pending", request_id)
+            reads.smembers(legacy_tenders_of_key(request_id))
+        results = reads.execute()
+        requests = [(request_id, created, data, complete, pending, award_keys)
+                    for (request_id, created), data, complete, pending, award_keys
+                    in zip(batch, results[::4], results[1::4], results[2::4], results[3::4]) if data.get("code")]
+        award_keys = list({key for request in requests for key in request[5]})
+        reads = self._db.pipeline(transaction=False)
+        for key in award_keys:
+            reads.hgetall(key)
+        awards = dict(zip(award_keys, reads.execute() if award_keys else []))
+        if not requests:
+            return 0
+        now = time()
+        pipe = self._db.pipeline(transaction=False)
+        # codes are indexed first, each index in one command for the batch
+        codes = {data["code"] for _, _, data, _, _, _ in requests}
+        pipe.zadd(CODES_KEY, *[value for code in codes for value in (now, code)])
+        pending_codes = {data["code"] for _, _, data, _, pending, _ in requests if pending}
+        if pending_codes:
+            pipe.zadd(PENDING_CODES_KEY, *[value for code in pending_codes for value in (now, code)])
+        for request_id, created, data, complete, pending, keys in requests:
+            code = data["code"]
+            pipe.hmset(request_key(code, request_id), data)
+            pipe.zadd(code_dates_key(code), created, request_id)
+            if complete:
+                pipe.zadd(code_complete_key(code), created, request_id)
+            if pending:
+                pipe.sadd(code_pending_key(code), request_id)
+            for key in keys:
+                award = awards[key]
+                if not award.get("data"):
+                    continue
+                field = key.split(":", 1)[1]
+                pipe.zadd(code_awards_key(code), 0, "{}:{}".format(request_id, field))
+                pipe.hset(code_award_data_key(code), field, award["data"])
+                # the award hash belongs to the request which bound it last, which may be of another code
+                if award.get("request_id") == request_id or loads(award["data"]).get("code") != code:
+                    pipe.hset(code_owners_key(code), field, request_id)
+        pipe.execute()
+        return len(requests)
+
+    def _remove_legacy_keys(self, batch):
+        reads = self._db.pipeline(transaction=False)
+        for request_id, _ in batch:
+            reads.hget(legacy_request_key(request_id), "code")
+            reads.smembers(legacy_tenders_of_key(request_id))
+        results = reads.execute()
+        keys = [key for award_keys in results[1::2] for key in award_keys]
+        keys += [legacy_tenders_of_key(request_id) for request_id, _ in batch]
+        keys += [key for code in set(results[::2]) if code for key in legacy_code_keys(code)]
+        # hashes of the requests go last, as a removal which is run again finds the codes in them
+        keys += [legacy_request_key(request_id) for request_id, _ in batch]
+        self._remove_keys(keys)
+
+    def _remove_keys(self, keys):
+        pipe = self._db.pipeline(transaction=False)
+        for key in keys:
+            pipe.delete(key)
+        pipe.execute()
+
+    def get_tenders_of_request(self, request_id, code):
+        """Data of all awards bound to the request, read by one script in one round trip"""
+        dumps = self._tenders_of(keys=[code_awards_key(code), code_award_data_key(code)], args=[request_id])
+        return [load_data(dump) for dump in dumps if dump]
+
+    def find_or_create_request(self, data, request_id, day=None, allowance=None):
+        """Find a recent request for data.code, completed ones first, or register a new one with request_id, and
+        bind the award to it. A new request is counted against the day's requests and is not created if there are
+        already allowance of them. Returns (request ID, status) where status is one of "complete", "pending", "new"
+        or "quota"; request ID is None if quota is exhausted.
+
+        Lookup, registration and binding are one script over the keys of the code, so concurrent bridges never
+        register two requests for a code. On a single node the script also counts the request against the day and
+        indexes the code, which makes it one round trip. The day's counter and the code indexes are shared by all
+        codes, so on sharded databases they can't be in the script: when the code has no recent request, the code
+        is indexed and the request counted before it is registered, in two more round trips. A failure between them
+        leaves at most an indexed code without requests, which is dropped later, and one request counted in vain;
+        the count is given back if another bridge registered a request for the code meanwhile"""
+        now = time()
+        args = [now, now - self.time_range, request_id, 1, data.code, data.tender_id, data.award_id, data.name,
+                data.db_dump(), allowance, DAILY_REQUESTS_TTL, dump_with_source(data, request_id)]
+        keys = code_keys(data.code) + [request_key(data.code, request_id)]
+        if not self._db.sharded:
+            keys += [CODES_KEY, PENDING_CODES_KEY] + ([daily_key(day)] if allowance is not None else [])
+            found_id, status = self._find_or_create(keys=keys, args=args)
+            return found_id or None, status
+        found_id, status = self._find_or_create(keys=keys, args=args[:3] + [0] + args[4:])
+        if status != "missing":
+            return found_id, status
+        pipe = self._db.pipeline()
+        pipe.zadd(CODES_KEY, now, data.code)
+        pipe.zadd(PENDING_CODES_KEY, now, data.code)
+        if allowance is not None:
+            pipe.incr(daily_key(day))
+            pipe.expire(daily_key(day), DAILY_REQUESTS_TTL)
+            if pipe.execute()[2] > allowance:
+                self._db.decr(daily_key(day))
+                return None, "quota"
+        else:
+            pipe.execute()
+        found_id, status = self._find_or_create(keys=keys, args=args)
+        if status != "new" and allowance is not None:
+            self._db.decr(daily_key(day))
+        return found_id, status
+
+    def add_daily_request(self, day):
+        """Count a request sent on the day; returns the number of requests sent that day"""
+        pipe = self._db.pipeline()
+        pipe.incr(daily_key(day))
+        pipe.expire(daily_key(day), DAILY_REQUESTS_TTL)
+        return pipe.execute()[0]
+
+    def daily_requests(self, day):
+        return int(self._db.get(daily_key(day)) or 0)
+
+    def add_to_backlog(self, data):
+        self._db.rpush("requests:backlog", data.db_dump())
+
+    def pop_backlog(self):
+        dump = self._db.lpop("requests:backlog")
+        return load_data(dump) if dump else None
+
+    def backlog_size(self):
+        return self._db.llen("requests:backlog")
+
+
+def find_or_create(db, keys, args):
+    """FIND_OR_CREATE_SCRIPT for stores which can't run Lua"""
+    found = status = None
+    for index, index_status in ((keys[0], "complete"), (keys[1], "pending")):
+        found = (db.zrangebyscore(index, args[1], args[0], start=0, num=1) or [None])[0]
+        if found:
+            status = index_status
+            break
+    if not found:
+        if str(args[3]) != "1":
+            return ["", "missing"]
+        if len(keys) > 7:
+            if len(keys) > 9:
+                if int(db.get(keys[9]) or 0) >= int(args[9]):
+                    return ["", "quota"]
+                db.incr(keys[9])
+                db.expire(keys[9], args[10])
+            db.zadd(keys[7], args[0], args[4])
+            db.zadd(keys[8], args[0], args[4])
+        db.hmset(keys[6], {"code": args[4], "tender_id": args[5], "name": args[7], "response": "placeholder"})
+        db.zadd(keys[1], args[0], args[2])
+        db.sadd(keys[2], args[2])
+        found, status = args[2], "new"
+    award = award_field(args[5], args[6])
+    db.zadd(keys[3], 0, "{}:{}".format(found, award))
+    db.hset(keys[4], award, found)
+    db.hset(keys[5], award, args[11] if status == "new" else args[8])
+    return [found, status]
+
+
+def complete(db, keys, args):
+    """COMPLETE_SCRIPT for stores which can't run Lua"""
+    created = db.zscore(keys[1], args[0])
+    db.zadd(keys[0], args[1] if created is None else created, args[0])
+    db.srem(keys[2], args[0])
+    db.hset(keys[6], "status", "complete")
+
 
-    def get_award(self, key):
-        return self._db.hgetall(key)
+def expire(db, keys, args):
+    """EXPIRE_SCRIPT for stores which can't run Lua"""
+    requests = pending = bindings = size = 0
+    for key, request_id in zip(keys[6:], args):
+        size += sum(len(field) + len(value) for field, value in db.hgetall(key).items())
+        requests += db.delete(key)
+        db.zrem(keys[0], request_id)
+        db.zrem(keys[1], request_id)
+        pending += db.srem(keys[2], request_id)
+        for member in db.zrangebylex(keys[3], "[{}:".format(request_id), "({};".format(request_id)):
+            award = member[len(request_id) + 1:]
+            db.zrem(keys[3], member)
+            bindings, size = bindings + 1, size + len(member)
+            if db.hget(keys[4], award) == request_id:
+                size += len(award) * 2 + len(request_id) + len(db.hget(keys[5], award) or "")
+                db.hdel(keys[4], award)
+                db.hdel(keys[5], award)
+    return [requests, pending, bindings, size, db.zcard(keys[1])]
 
-    def get_tenders_of_request(self, request_id):
-        tender_dicts = [self.get_award(key) for key in self._db.smembers("tenders_of:{}".format(request_id))]
-        all_the_data = []
-        for tender_dict in tender_dicts:
-            t_data = loads(tender_dict["data"])
-            data = Data(t_data['tender_id'], t_data['award_id'], t_data['code'], t_data['name'], t_data['file_content'])
-            all_the_data.append(data)
-        return all_the_data
 
-    def add_daily_request(self):
-        self._db.incr("requests:number")
+def tenders_of(db, keys, args):
+    """TENDERS_OF_SCRIPT for stores which can't run Lua"""
+    members = db.zrangebylex(keys[0], "[{}:".format(args[0]), "({};".format(args[0]))
+    return db.hmget(keys[1], [member[len(args[0]) + 1:] for member in members]) if members else []
 
 
-def award_key(tender_id, award_id):
-    return "tender:{}:{}".format(tender_id, award_id)
+def remove_stale(db, keys, args):
+    """REMOVE_STALE_SCRIPT for stores which can't run Lua"""
+    score = db.zscore(keys[0], args[0])
+    if score is not None and score == float(args[1]):
+        return db.zrem(keys[0], args[0])
+    return 0
 
 
-def req_key(request_id):
+def dump_with_source(data, request_id):
+    """data.db_dump() with request_id among its sourceRequests, as the award is sent in the request"""
+    sources = data.file_content.get('meta', {}).get('sourceRequests')
+    if sources is None or request_id in sources:
+        return data.db_dump()
+    sources.append(request_id)
+    try:
+        return data.db_dump()
+    finally:
+        sources.pop()
+
+
+def load_data(dump):
+    t_data = loads(dump)
+    return Data(t_data['tender_id'], t_data['award_id'], t_data['code'], t_data['name'], t_data['file_content'])
+
+
+def award_field(tender_id, award_id):
+    return "{}:{}".format(tender_id, award_id)
+
+
+def request_key(code, request_id):
+    return "requests:{{{}}}:{}".format(code, request_id)
+
+
+def code_keys(code):
+    return [code_complete_key(code), code_dates_key(code), code_pending_key(code), code_awards_key(code),
+            code_owners_key(code), code_award_data_key(code)]
+
+
+def code_dates_key(code):
+    return "requests:edrpou:{{{}}}:dates".format(code)
+
+
+def code_complete_key(code):
+    return "requests:edrpou:{{{}}}:complete".format(code)
+
+
+def code_pending_key(code):
+    return "requests:edrpou:{{{}}}:pending".format(code)
+
+
+def code_awards_key(code):
+    return "requests:edrpou:{{{}}}:awards".format(code)
+
+
+def code_owners_key(code):
+    return "requests:edrpou:{{{}}}:owners".format(code)
+
+
+def code_award_data_key(code):
+    return "requests:edrpou:{{{}}}:award_data".format(code)
+
+
+def legacy_request_key(request_id):
     return "requests:{}".format(request_id)
+
+
+def legacy_tenders_of_key(request_id):
+    return "tenders_of:{}".format(request_id)
+
+
+def legacy_code_keys(code):
+    """requests:edrpou:<code> set and the results of ZINTERSTORE lookups of the code"""
+    return ["requests:edrpou:{}".format(code), "recent:requests:edrpou:{}".format(code),
+            "recent:complete:edrpou:{}:".format(code)]
+
+
+def daily_key(day):
+    return "requests:number:{}".format(day.isoformat())
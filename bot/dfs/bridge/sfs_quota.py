@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from math import ceil
+
+from constants import TZ, WORKING_HOURS
+from utils import business_date_checker
+
+
+class SfsQuota(object):
+    """Daily limit of requests to SFS, counted per business day in TZ and released evenly over working hours, so that
+    by any moment of the day no more than the elapsed share of daily_limit is used"""
+
+    def __init__(self, requests_db, daily_limit=100):
+        self.requests_db = requests_db
+        self.daily_limit = daily_limit
+
+    def allowance(self, now):
+        """How many requests may be sent by now since the local midnight"""
+        start = now.replace(hour=WORKING_HOURS[0].hour, minute=WORKING_HOURS[0].minute, second=0, microsecond=0)
+        end = now.replace(hour=WORKING_HOURS[1].hour, minute=WORKING_HOURS[1].minute, second=0, microsecond=0)
+        elapsed = (now - start).total_seconds() / (end - start).total_seconds()
+        return int(ceil(self.daily_limit * min(max(elapsed, 0), 1)))
+
+    def current_allowance(self):
+        """Today's date and how many requests may be sent today by now; nothing is allowed out of business time"""
+        now = datetime.now(TZ)
+        return now.date(), (self.allowance(now) if business_date_checker() else 0)
+
+    def available(self):
+        day, allowance = self.current_allowance()
+        return self.requests_db.daily_requests(day) < allowance
+
+    def used(self):
+        return self.requests_db.daily_requests(datetime.now(TZ).date())
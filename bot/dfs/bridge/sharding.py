@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from binascii import crc_hqx
+from itertools import chain
+
+SLOTS = 16384
+
+
+def key_slot(key):
+    """Redis Cluster hash slot of the key; if the key has a non-empty {hash tag} only the tag is hashed, so keys sharing
+    a tag always land in one slot"""
+    key = key.encode('utf-8') if isinstance(key, unicode) else str(key)
+    start = key.find("{")
+    if start > -1:
+        end = key.find("}", start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return crc_hqx(key, 0) % SLOTS
+
+
+class ShardedRedis(object):
+    """Client-side sharding of the subset of redis.StrictRedis used by the bridge over independent redis nodes. Hash
+    slots are split between the nodes in equal contiguous ranges, so the placement of keys is the same as in a
+    cluster of the same size. Commands which take one key are sent to the node of the key"""
+
+    def __init__(self, clients):
+        self.clients = clients
+
+    def node_index(self, key):
+        return key_slot(key) * len(self.clients) // SLOTS
+
+    def node(self, key):
+        return self.clients[self.node_index(key)]
+
+    def __getattr__(self, name):
+        def command(key, *args, **kwargs):
+            return getattr(self.node(key), name)(key, *args, **kwargs)
+
+        return command
+
+    def execute_command(self, *args, **options):
+        """Takes the command name and its key first, like "MEMORY USAGE", key"""
+        return self.node(args[1]).execute_command(*args, **options)
+
+    def delete(self, *keys):
+        return sum(self.node(key).delete(key) for key in keys)
+
+    def scan_iter(self, match=None, count=None):
+        return chain.from_iterable(client.scan_iter(match, count) for client in self.clients)
+
+    def flushall(self):
+        return all([client.flushall() for client in self.clients])
+
+    def pipeline(self, transaction=True):
+        return ShardedPipeline(self, transaction)
+
+    def register_script(self, script):
+        return ShardedScript(self, script)
+
+
+class ShardedPipeline(object):
+    """Queues every command on a pipeline of its node and executes the pipelines of all involved nodes on execute;
+    results are returned in the order the commands were queued. Commands sent to one node are wrapped in MULTI/EXEC if
+    transaction, but there is no atomicity across nodes"""
+
+    def __init__(self, sharded, transaction=True):
+        self.sharded = sharded
+        self.transaction = transaction
+        self.pipes = {}
+        self.order = []
+
+    def _queue(self, index, name, *args, **kwargs):
+        if index not in self.pipes:
+            self.pipes[index] = self.sharded.clients[index].pipeline(self.transaction)
+        getattr(self.pipes[index], name)(*args, **kwargs)
+        self.order.append(index)
+        return self
+
+    def __getattr__(self, name):
+        def queue(key, *args, **kwargs):
+            return self._queue(self.sharded.node_index(key), name, key, *args, **kwargs)
+
+        return queue
+
+    def execute_command(self, *args, **options):
+        return self._queue(self.sharded.node_index(args[1]), "execute_command", *args, **options)
+
+    def execute(self, raise_on_error=True):
+        pipes, order, self.pipes, self.order = self.pipes, self.order, {}, []
+        results = {index: iter(pipe.execute(raise_on_error=raise_on_error)) for index, pipe in pipes.items()}
+        return [next(results[index]) for index in order]
+
+
+class ShardedScript(object):
+    """Lua script registered on every node; a call runs on the node of its keys, which must all be on one node"""
+
+    def __init__(self, sharded, script):
+        self.sharded = sharded
+        self.scripts = [client.register_script(script) for client in sharded.clients]
+
+    def __call__(self, keys=[], args=[]):
+        nodes = {self.sharded.node_index(key) for key in keys}
+        if len(nodes) != 1:
+            raise ValueError("Keys {} of the script are not on one node".format(keys))
+        return self.scripts[nodes.pop()](keys=keys, args=args)
@@ -1,4 +1,9 @@
 # -*- coding: utf-8 -*-
+from time import time
+
+from gevent import sleep
+
+
 class APIRateController(object):
     def __init__(self, increment_step=1, decrement_step=1):
         self.increment_step = increment_step
@@ -12,3 +17,33 @@ class APIRateController(object):
     def increment(self):
         self.time_between_requests += self.increment_step
         return self.time_between_requests
+
+
+class TokenBucket(object):
+    """Lets through requests_per_minute requests on average and up to burst of them at once"""
+
+    def __init__(self, requests_per_minute=4, burst=1):
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time()
+
+    def _refill(self):
+        now = time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        self._refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        while not self.try_acquire():
+            sleep(self.wait_time())
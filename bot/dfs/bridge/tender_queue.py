@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from gevent.lock import Semaphore
+from gevent.queue import Empty, Full, Queue
+
+
+class TenderQueue(object):
+    """Queue of tender IDs which serves live (forward sync) tenders before backfill (backward sync) ones.
+
+    Every served live tender gives backfill backfill_share of a turn, so while both parts are not empty at least
+    that share of served tenders comes from backfill. peek() and get() called one after another return the same
+    tender. maxsize bounds both parts together."""
+
+    def __init__(self, maxsize=None, backfill_share=0.1):
+        self.live = Queue()
+        self.backfill = Queue()
+        self.backfill_share = backfill_share
+        self._backfill_credit = 0
+        self._available = Semaphore(0)
+        self._space = Semaphore(maxsize) if maxsize else None
+        self._next = None
+
+    def put(self, item, block=True, timeout=None, backfill=False):
+        if self._space is not None and not self._space.acquire(block, timeout):
+            raise Full
+        (self.backfill if backfill else self.live).put(item)
+        self._available.release()
+
+    def peek(self, block=True, timeout=None):
+        if not self._available.wait(timeout if block else 0):
+            raise Empty
+        return self._next_queue().peek_nowait()
+
+    def get(self, block=True, timeout=None):
+        return self.get_entry(block, timeout)[0]
+
+    def get_entry(self, block=True, timeout=None):
+        """Same as get, but returns the tender together with the flag whether it was put as backfill"""
+        if not self._available.acquire(block, timeout):
+            raise Empty
+        queue = self._next_queue()
+        self._next = None
+        if queue is self.live:
+            self._backfill_credit = min(self._backfill_credit + self.backfill_share, 1)
+        elif self.live.qsize():
+            self._backfill_credit -= 1
+        if self._space is not None:
+            self._space.release()
+        return queue.get_nowait(), queue is self.backfill
+
+    def _next_queue(self):
+        if self._next is None:
+            backfill_turn = not self.live.qsize() or self._backfill_credit >= 1
+            self._next = self.backfill if self.backfill.qsize() and backfill_turn else self.live
+        return self._next
+
+    def qsize(self):
+        return self.live.qsize() + self.backfill.qsize()
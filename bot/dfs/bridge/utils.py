@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 import io
-from datetime import datetime, time
+from datetime import datetime
 from json import loads
 from logging import getLogger
 from string import digits, uppercase
@@ -9,7 +9,7 @@ from uuid import uuid4
 import os
 
 import yaml
-from constants import (AWARD_STATUS, DOC_TYPE, FORM_NAME, HOLIDAYS_FILE, TZ, file_name,
+from constants import (AWARD_STATUS, DOC_TYPE, FORM_NAME, HOLIDAYS_FILE, TZ, WORKING_HOURS, file_name,
                        qualification_procurementMethodType, tender_status)
 from restkit import ResourceError
 
@@ -59,7 +59,7 @@ def is_no_document_in_edr(response, res_json):
 
 
 def should_process_item(item):
-    return (item['status'] == AWARD_STATUS and not [document for document in item.get('documents', [])
+    return (item.get('status') == AWARD_STATUS and not [document for document in item.get('documents', [])
                                                     if document.get('documentType') == DOC_TYPE])
 
 
@@ -128,7 +128,7 @@ def business_date_checker():
     if cond1(current_date, holidays) or cond2(current_date, holidays):
         return False
     else:
-        if time(9, 0) <= current_date.time() <= time(18, 0):
+        if WORKING_HOURS[0] <= current_date.time() <= WORKING_HOURS[1]:
             return True
         else:
             return False
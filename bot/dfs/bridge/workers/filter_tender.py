@@ -8,12 +8,13 @@ import gevent
 from datetime import datetime
 from gevent import spawn
 from gevent.hub import LoopExit
-from simplejson import loads
+from gevent.pool import Pool
 
-from bot.dfs.bridge.utils import generate_req_id, journal_context, is_code_valid
+from bot.dfs.bridge.utils import generate_req_id, journal_context, is_code_valid, should_process_item
+from bot.dfs.bridge.codec import dumps, loads
 from bot.dfs.bridge.data import Data
 from bot.dfs.bridge.workers.base_worker import BaseWorker
-from bot.dfs.bridge.journal_msg_ids import DATABRIDGE_TENDER_NOT_PROCESS
+from bot.dfs.bridge.journal_msg_ids import DATABRIDGE_SKIP_NOT_MODIFIED, DATABRIDGE_TENDER_NOT_PROCESS
 from bot.dfs.bridge.constants import scheme
 
 logger = logging.getLogger(__name__)
@@ -23,11 +24,15 @@ class FilterTenders(BaseWorker):
     """ Edr API XmlData Bridge """
 
     def __init__(self, tenders_sync_client, filtered_tender_ids_queue, edrpou_codes_queue, process_tracker,
-                 services_not_available, sleep_change_value, delay=15):
+                 services_not_available, sleep_change_value, delay=15, pool_size=1, awards_only=False, db=None,
+                 validators_ttl=604800):
         super(FilterTenders, self).__init__(services_not_available)
         self.start_time = datetime.now()
 
         self.delay = delay
+        self.awards_only = awards_only
+        self.db = db
+        self.validators_ttl = validators_ttl
         self.process_tracker = process_tracker
         # init clients
         self.tenders_sync_client = tenders_sync_client
@@ -37,9 +42,15 @@ class FilterTenders(BaseWorker):
         self.edrpou_codes_queue = edrpou_codes_queue
         self.sleep_change_value = sleep_change_value
 
+        # fetchers
+        self.pool = Pool(pool_size)
+        self.tenders_in_process = set()
+        self.tenders_to_refetch = {}  # tender_id: backfill of tenders queued again while they were being fetched
+
     def prepare_data(self):
-        """Get tender_id from filtered_tender_ids_queue, check award/qualification status, documentType; get
-        identifier's id and put into edrpou_codes_queue."""
+        """Get tender_id from filtered_tender_ids_queue and pass it to the pool of fetchers, no more than one of them
+        works on the same tender at a time. Tender which comes while it is being fetched is fetched again after that,
+        as it could have changed after the running fetch got it."""
         while not self.exit:
             self.services_not_available.wait()
             try:
@@ -47,33 +58,96 @@ class FilterTenders(BaseWorker):
             except LoopExit:
                 gevent.sleep()
                 continue
-            try:
-                response = self.tenders_sync_client.request("GET",
-                                                            path='{}/{}'.format(self.tenders_sync_client.prefix_path,
-                                                                                tender_id),
-                                                            headers={'X-Client-Request-ID': generate_req_id()})
-            except Exception as e:
-                if getattr(e, "status_int", False) == 429:
-                    self.sleep_change_value.increment()
-                    logger.info("Waiting tender {} for sleep_change_value: {} seconds".format(
-                        tender_id, self.sleep_change_value.time_between_requests))
-                else:
-                    logger.warning('Fail to get tender info {}. Message {}'.format(tender_id, e.message),
-                                   extra=journal_context(params={"TENDER_ID": tender_id}))
-                    gevent.sleep()
-            else:
-                self.sleep_change_value.decrement()
-                if response.status_int == 200:
-                    self.process_response(response)
-                else:
-                    logger.warning('Fail to get tender info {}'.format(tender_id),
-                                   extra=journal_context(params={"TENDER_ID": tender_id}))
-                self.filtered_tender_ids_queue.get()
+            self.pool.wait_available()
+            tender_id, backfill = self.filtered_tender_ids_queue.get_entry()
+            if tender_id in self.tenders_in_process:
+                logger.info('Tender {} is already being fetched, it will be fetched again'.format(tender_id),
+                            extra=journal_context(params={"TENDER_ID": tender_id}))
+                self.tenders_to_refetch[tender_id] = self.tenders_to_refetch.get(tender_id, True) and backfill
+                continue
+            self.tenders_in_process.add(tender_id)
+            self.pool.spawn(self.get_tender, tender_id, backfill)
             gevent.sleep(self.sleep_change_value.time_between_requests)
 
-    def process_response(self, response):
-        tender = loads(response.body_string())['data']
+    def get_tender(self, tender_id, backfill=False):
+        """Check award/qualification status, documentType; get identifier's id and put into edrpou_codes_queue.
+        Tender is put back to filtered_tender_ids_queue if it could not be fetched or was queued again meanwhile."""
+        retry = False
+        try:
+            headers = {'X-Client-Request-ID': generate_req_id()}
+            headers.update(self.conditional_headers(tender_id))
+            response = self.tenders_sync_client.request("GET", path=self.tender_path(tender_id), headers=headers)
+        except Exception as e:
+            retry = True
+            if getattr(e, "status_int", False) == 429:
+                self.sleep_change_value.increment()
+                logger.info("Waiting tender {} for sleep_change_value: {} seconds".format(
+                    tender_id, self.sleep_change_value.time_between_requests))
+            else:
+                logger.warning('Fail to get tender info {}. Message {}'.format(tender_id, e.message),
+                               extra=journal_context(params={"TENDER_ID": tender_id}))
+        else:
+            self.sleep_change_value.decrement()
+            if response.status_int == 200:
+                self.process_response(response, tender_id)
+                self.save_validators(tender_id, response)
+            elif response.status_int == 304:
+                logger.info('Tender {} was not modified since last fetch'.format(tender_id),
+                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_SKIP_NOT_MODIFIED},
+                                                  {"TENDER_ID": tender_id}))
+                if tender_id not in self.tenders_to_refetch:
+                    self.process_tracker.set_tender_fetched(tender_id)
+            else:
+                logger.warning('Fail to get tender info {}'.format(tender_id),
+                               extra=journal_context(params={"TENDER_ID": tender_id}))
+        finally:
+            self.tenders_in_process.discard(tender_id)
+        if tender_id in self.tenders_to_refetch:
+            retry, backfill = True, self.tenders_to_refetch.pop(tender_id) and backfill
+        if retry:
+            # fetchers must not block on full queue, which only dispatcher waiting for them could empty
+            spawn(self.filtered_tender_ids_queue.put, tender_id, backfill=backfill)
+        else:
+            self.process_tracker.unschedule_tender(tender_id)
+
+    def conditional_headers(self, tender_id):
+        """Validators of the last processed response, so that API answers 304 if tender did not change since"""
+        validators = self.db.get(validators_key(self.tender_path(tender_id))) if self.db is not None else None
+        if not validators:
+            return {}
+        validators = loads(validators)
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def save_validators(self, tender_id, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if self.db is not None and (etag or last_modified):
+            self.process_tracker.set_tender_validators(tender_id, validators_key(self.tender_path(tender_id)),
+                                                       dumps({'etag': etag, 'last_modified': last_modified}),
+                                                       self.validators_ttl)
+
+    def tender_path(self, tender_id):
+        """Awards subresource is enough to find codes and it does not grow with tender documents and bids"""
+        if self.awards_only:
+            return '{}/{}/awards'.format(self.tenders_sync_client.prefix_path, tender_id)
+        return '{}/{}'.format(self.tenders_sync_client.prefix_path, tender_id)
+
+    def process_response(self, response, tender_id=None):
+        data = loads(response.body_string())['data']
+        tender = {'id': tender_id, 'awards': data} if self.awards_only else data
         for aw in active_award(tender):
+            if (self.process_tracker.check_processing_item(tender['id'], aw['id']) or
+                    self.process_tracker.check_processed_item(tender['id'], aw['id'])):
+                logger.info('Tender {} award {} is already in process or was processed.'.format(
+                    tender['id'], aw['id']),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_TENDER_NOT_PROCESS},
+                                          journal_item_params(tender['id'], aw.get('bid_id'), aw['id'])))
+                break
             logger.info("active award {}".format(active_award(tender)))
             for code in get_codes(aw):
                 logger.info("code {}".format(code))
@@ -92,6 +166,9 @@ class FilterTenders(BaseWorker):
             logger.info('Tender {} is already in process or was processed.'.format(tender['id']),
                         extra=journal_context({"MESSAGE_ID": DATABRIDGE_TENDER_NOT_PROCESS},
                                               {"TENDER_ID": tender['id']}))
+        if tender['id'] in self.tenders_to_refetch:
+            return  # feed has a newer version of the tender, fetch of which records it
+        self.process_tracker.set_tender_fetched(tender['id'], tender.get('dateModified'))
 
     def _start_jobs(self):
         return {'prepare_data': spawn(self.prepare_data)}
@@ -101,8 +178,12 @@ def journal_item_params(tender_id, bid_id, award_id):
     return {"TENDER_ID": tender_id, "BID_ID": bid_id, "AWARD_ID": award_id}
 
 
+def validators_key(path):
+    return "validators:{}".format(path)
+
+
 def active_award(tender):
-    return [aw for aw in tender.get('awards', []) if aw.get('status') == 'active']
+    return [aw for aw in tender.get('awards', []) if should_process_item(aw)]
 
 
 def get_codes(award):
@@ -37,16 +37,15 @@ class RequestForReference(BaseWorker):
             self.services_not_available.wait()
             if business_date_checker():
                 try:
-                    request_ids = self.request_db.get_pending_requests()
-                    logger.info(u"got pending requests: {}".format(request_ids))
+                    self.check_incoming_correspondence(self.request_db.iter_pending_requests())
                 except Exception as e:
                     logger.warning(u'Fail to get pending requests. Message {}'.format(e.message))
-                else:
-                    self.check_incoming_correspondence(request_ids)
             sleep(15)
 
-    def check_incoming_correspondence(self, request_ids):
-        for request_id, request_data in request_ids.items():
+    def check_incoming_correspondence(self, pending_requests):
+        """Check pending requests as they come from the database; takes (request ID, request data) pairs"""
+        for request_id, request_data in pending_requests:
+            logger.info(u"got pending request: {} {}".format(request_id, request_data))
             code = request_data['code']
             ca_name = ''
             try:
@@ -75,7 +74,7 @@ class RequestForReference(BaseWorker):
         else:
             try:
                 logger.info('Put request_id {} to process...'.format(request_id))
-                all_the_data = self.request_db.get_tenders_of_request(request_id)
+                all_the_data = self.request_db.get_tenders_of_request(request_id, code)
                 yamled_data = {"meta": {"id": "123"}} # TODO: placeholder; presume it will contain stuff needed
                 for data in all_the_data:
                     data.file_content['meta'].update(yamled_data['meta'])
@@ -0,0 +1,55 @@
+# coding=utf-8
+from gevent import monkey
+
+monkey.patch_all()
+
+import logging.config
+
+from datetime import datetime
+from gevent import sleep, spawn
+from time import time
+
+from bot.dfs.bridge.journal_msg_ids import DATABRIDGE_REQUESTS_COMPACTED
+from bot.dfs.bridge.utils import journal_context
+from bot.dfs.bridge.workers.base_worker import BaseWorker
+
+logger = logging.getLogger(__name__)
+
+
+class RequestsCompactor(BaseWorker):
+    """Removes SFS requests older than horizon seconds with their awards and index entries, pending ones included:
+    a request SFS has not answered within the horizon is not waited for any longer"""
+
+    def __init__(self, requests_db, services_not_available, horizon=2592000, batch_size=100, interval=3600):
+        super(RequestsCompactor, self).__init__(services_not_available)
+        self.start_time = datetime.now()
+        self.requests_db = requests_db
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def compact(self):
+        while not self.exit:
+            removed_requests = removed_pending = removed_bindings = reclaimed_bytes = 0
+            try:
+                for requests, pending, bindings, size in self.requests_db.expire_requests(time() - self.horizon,
+                                                                                          self.batch_size):
+                    removed_requests += requests
+                    removed_pending += pending
+                    removed_bindings += bindings
+                    reclaimed_bytes += size
+                    sleep()
+            except Exception as e:
+                logger.warning(u"Fail to compact requests. Message {}".format(e.message))
+            logger.info(u"Requests compaction removed {} requests ({} of them pending) and {} award bindings, "
+                        u"reclaimed {} bytes".format(removed_requests, removed_pending, removed_bindings,
+                                                     reclaimed_bytes),
+                        extra=journal_context({"MESSAGE_ID": DATABRIDGE_REQUESTS_COMPACTED},
+                                              {"REMOVED_REQUESTS": removed_requests,
+                                               "REMOVED_PENDING_REQUESTS": removed_pending,
+                                               "REMOVED_AWARD_BINDINGS": removed_bindings,
+                                               "RECLAIMED_BYTES": reclaimed_bytes}))
+            sleep(self.interval)
+
+    def _start_jobs(self):
+        return {'compact': spawn(self.compact)}
@@ -3,30 +3,49 @@ from gevent import monkey
 
 monkey.patch_all()
 import logging.config
+import random
 from datetime import datetime
 
 import gevent
 from bot.dfs.bridge.workers.base_worker import BaseWorker
 from bot.dfs.bridge.constants import retry_mult
 from gevent import spawn
+from gevent.pool import Pool
 from gevent.event import Event
+from gevent.queue import Queue
 from bot.dfs.bridge.journal_msg_ids import (DATABRIDGE_INFO, DATABRIDGE_SYNC_SLEEP, DATABRIDGE_TENDER_PROCESS,
                                             DATABRIDGE_WORKER_DIED)
-from restkit import ResourceError
+from restkit import RequestError, ResourceError
 from retrying import retry
 from bot.dfs.bridge.utils import generate_req_id, journal_context, more_tenders, valid_qualification_tender
 
 logger = logging.getLogger(__name__)
 
+FEED_PAGE_LIMIT = 100
+OPT_FIELDS = 'status,procurementMethodType,dateModified'
+
 
 class Scanner(BaseWorker):
     """ Edr API Data Bridge """
 
     def __init__(self, tenders_sync_client, filtered_tender_ids_queue, services_not_available, process_tracker,
-                 sleep_change_value, delay=15):
+                 sleep_change_value, delay=15, db=None, full_resync=False, backward_shards=1,
+                 backward_pool_size=1, backward_history_days=365, full_stack_sync_delay=None,
+                 empty_stack_sync_delay=None, on_error_sleep_delay=5, prefetch_pages=0, dedup_filter=None):
         super(Scanner, self).__init__(services_not_available)
         self.start_time = datetime.now()
         self.delay = delay
+        self.db = db
+        self.full_resync = full_resync
+        self.backward_shards = backward_shards
+        self.backward_pool_size = backward_pool_size
+        self.backward_history_days = backward_history_days
+        self.full_stack_sync_delay = delay if full_stack_sync_delay is None else full_stack_sync_delay
+        self.empty_stack_sync_delay = delay if empty_stack_sync_delay is None else empty_stack_sync_delay
+        self.on_error_sleep_delay = on_error_sleep_delay
+        self.max_error_retries = 5
+        self.prefetch_pages = prefetch_pages
+        self.dedup_filter = dedup_filter
         # init clients
         self.tenders_sync_client = tenders_sync_client
 
@@ -44,28 +63,41 @@ class Scanner(BaseWorker):
         if direction == "backward":
             self.initialization_event.clear()
             assert params['descending']
-            response = self.tenders_sync_client.sync_tenders(params,
-                                                             extra_headers={'X-Client-Request-ID': generate_req_id()})
-            # set values in reverse order due to 'descending' option
-            self.initial_sync_point = {'forward_offset': response.prev_page.offset,
-                                       'backward_offset': response.next_page.offset}
+            sync_point = self.load_sync_point()
+            if sync_point:
+                params['offset'] = sync_point['backward_offset']
+                response = self.tenders_sync_client.sync_tenders(
+                    params, extra_headers={'X-Client-Request-ID': generate_req_id()})
+                self.initial_sync_point = sync_point
+                logger.info("Resuming sync from saved sync point {}".format(self.initial_sync_point))
+            else:
+                response = self.tenders_sync_client.sync_tenders(
+                    params, extra_headers={'X-Client-Request-ID': generate_req_id()})
+                # set values in reverse order due to 'descending' option
+                self.initial_sync_point = {'forward_offset': response.prev_page.offset,
+                                           'backward_offset': response.next_page.offset}
+                self.remove_shard_checkpoints()
+                self.save_checkpoint("forward", self.initial_sync_point['forward_offset'])
+                self.save_checkpoint("backward", self.initial_sync_point['backward_offset'])
+                self.full_resync = False
+                logger.info("Initial sync point {}".format(self.initial_sync_point))
             self.initialization_event.set()  # wake up forward worker
-            logger.info("Initial sync point {}".format(self.initial_sync_point))
             return response
         else:
             assert 'descending' not in params
             self.initialization_event.wait()
-            params['offset'] = self.initial_sync_point['forward_offset']
+            params['offset'] = self.load_checkpoint("forward") or self.initial_sync_point['forward_offset']
             logger.info("Starting forward sync from offset {}".format(params['offset']))
             return self.tenders_sync_client.sync_tenders(params,
                                                          extra_headers={'X-Client-Request-ID': generate_req_id()})
 
     def get_tenders(self, params={}, direction=""):
         response = self.initialize_sync(params=params, direction=direction)
-
-        while more_tenders(params, response):
+        pages = self.get_pages(response, params, direction)
+        if self.prefetch_pages:
+            pages = prefetch(pages, self.prefetch_pages)
+        for response, offset in pages:
             tenders = response.data if response else []
-            params['offset'] = response.next_page.offset
             for tender in tenders:
                 if self.should_process_tender(tender):
                     yield tender
@@ -74,28 +106,125 @@ class Scanner(BaseWorker):
                         tender['id'], tender['status'], tender['procurementMethodType']),
                         extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO},
                                               params={"TENDER_ID": tender['id']}))
+            self.save_checkpoint(direction, offset)
+
+    def get_pages(self, response, params, direction):
+        """Yield feed pages along with offset of the page that follows each of them"""
+        while more_tenders(params, response):
+            params['offset'] = response.next_page.offset
+            yield response, params['offset']
             logger.debug('Sleep {} sync...'.format(direction),
                          extra=journal_context({"MESSAGE_ID": DATABRIDGE_SYNC_SLEEP}))
-            gevent.sleep(self.delay + self.sleep_change_value.time_between_requests)
+            gevent.sleep(self.page_delay(response, params) + self.sleep_change_value.time_between_requests)
+            response = self.sync_page(params) or response
+
+    def page_delay(self, response, params):
+        """Full page means feed has more data right now, empty one means we have caught up with it"""
+        tenders = response.data if response else []
+        if len(tenders) >= params.get('limit', FEED_PAGE_LIMIT):
+            return 0
+        elif tenders:
+            return self.full_stack_sync_delay
+        return self.empty_stack_sync_delay
+
+    def sync_page(self, params):
+        """Request next feed page, return None if API asked us to slow down"""
+        errors = 0
+        while True:
             try:
                 response = self.tenders_sync_client.sync_tenders(params, extra_headers={
                     'X-Client-Request-ID': generate_req_id()})
                 self.sleep_change_value.decrement()
+                return response
             except ResourceError as re:
                 if re.status_int == 429:
                     self.sleep_change_value.increment()
-                    logger.info("Received 429, will sleep for {}".format(self.sleep_change_value.time_between_requests))
-                else:
+                    logger.info("Received 429, will sleep for {}".format(
+                        self.sleep_change_value.time_between_requests))
+                    return None
+                elif not (re.status_int >= 500 and errors < self.max_error_retries):
                     raise re
+                error = re
+            except RequestError as re:
+                if errors >= self.max_error_retries:
+                    raise re
+                error = re
+            errors += 1
+            delay = self.on_error_sleep_delay * 2 ** (errors - 1) * random.uniform(0.5, 1.5)
+            logger.warning("Fail to get feed page, will retry in {:.2f} seconds. Message {}".format(delay, error),
+                           extra=journal_context({"MESSAGE_ID": DATABRIDGE_SYNC_SLEEP}))
+            gevent.sleep(delay)
+
+    def plan_shards(self, upper):
+        """Split history from upper offset down to backward_history_days ago into equal ranges"""
+        lower = upper - self.backward_history_days * 24 * 60 * 60
+        step = (upper - lower) / self.backward_shards
+        return [(upper - step * (i + 1), upper - step * i) for i in range(self.backward_shards)]
+
+    def sync_backward_shards(self, params):
+        """Process the page which sets the sync point, then walk history below it in parallel shards"""
+        response = self.initialize_sync(params=params, direction="backward")
+        for tender in response.data if response else []:
+            if self.should_process_tender(tender):
+                self.put_tender_to_process(tender, backfill=True)
+        pool = Pool(self.backward_pool_size)
+        for lower, upper in self.plan_shards(float(self.initial_sync_point['backward_offset'])):
+            pool.spawn(self.put_shard_tenders_to_process, lower, upper)
+        pool.join(raise_error=True)
+
+    def put_shard_tenders_to_process(self, lower, upper):
+        """Walk descending feed from upper offset until it passes lower one"""
+        direction = shard_direction(lower, upper)
+        params = {'opt_fields': OPT_FIELDS, 'descending': 1, 'mode': '_all_',
+                  'offset': self.load_checkpoint(direction) or str(upper)}
+        logger.info('Start backward shard {} from offset {}'.format(direction, params['offset']))
+        while float(params['offset']) > lower:
+            response = self.sync_page(params)
+            if response is None:
+                gevent.sleep(self.sleep_change_value.time_between_requests)
+                continue
+            if not response.data:
+                break
+            for tender in response.data:
+                if self.should_process_tender(tender):
+                    self.put_tender_to_process(tender, backfill=True)
+            params['offset'] = response.next_page.offset
+            self.save_checkpoint(direction, params['offset'])
+            gevent.sleep(self.sleep_change_value.time_between_requests)
+        logger.info('Backward shard {} finished'.format(direction))
+
+    def load_sync_point(self):
+        """Return offsets saved by previous run, None if there are none or full resync is requested"""
+        if self.full_resync:
+            return None
+        forward_offset = self.load_checkpoint("forward")
+        backward_offset = self.load_checkpoint("backward")
+        if forward_offset and backward_offset:
+            return {'forward_offset': forward_offset, 'backward_offset': backward_offset}
+
+    def load_checkpoint(self, direction):
+        if self.db is not None and self.db.has(checkpoint_key(direction)):
+            return self.db.get(checkpoint_key(direction))
+
+    def save_checkpoint(self, direction, offset):
+        if self.db is not None:
+            self.db.put(checkpoint_key(direction), offset, None)
+
+    def remove_shard_checkpoints(self):
+        """Shard checkpoints are keyed by the bounds of the sync point which was split, a new one orphans them"""
+        if self.db is not None:
+            for key in list(self.db.scan_iter(checkpoint_key(shard_direction("*", "*")))):
+                self.db.remove(key)
 
     def should_process_tender(self, tender):
-        return valid_qualification_tender(tender)
+        return (valid_qualification_tender(tender) and
+                self.process_tracker.check_tender_modified(tender['id'], tender.get('dateModified')))
         # return not self.process_tracker.check_processed_tenders(tender['id']) and valid_qualification_tender(tender)
 
     def get_tenders_forward(self):
         self.services_not_available.wait()
         logger.info('Start forward data sync worker...')
-        params = {'opt_fields': 'status,procurementMethodType', 'mode': '_all_'}
+        params = {'opt_fields': OPT_FIELDS, 'mode': '_all_'}
         try:
             self.put_tenders_to_process(params, "forward")
         except Exception as e:
@@ -107,9 +236,12 @@ class Scanner(BaseWorker):
     def get_tenders_backward(self):
         self.services_not_available.wait()
         logger.info('Start backward data sync worker...')
-        params = {'opt_fields': 'status,procurementMethodType', 'descending': 1, 'mode': '_all_'}
+        params = {'opt_fields': OPT_FIELDS, 'descending': 1, 'mode': '_all_'}
         try:
-            self.put_tenders_to_process(params, "backward")
+            if self.backward_shards > 1:
+                self.sync_backward_shards(params)
+            else:
+                self.put_tenders_to_process(params, "backward")
         except Exception as e:
             logger.warning('Backward worker died!', extra=journal_context({"MESSAGE_ID": DATABRIDGE_WORKER_DIED}, {}))
             logger.exception("Message: {}".format(e.message))
@@ -120,10 +252,18 @@ class Scanner(BaseWorker):
 
     def put_tenders_to_process(self, params, direction):
         for tender in self.get_tenders(params=params, direction=direction):
-            logger.debug('Backward sync: Put tender {} to process...'.format(tender['id']),
+            logger.debug('{} sync: Put tender {} to process...'.format(direction.capitalize(), tender['id']),
                          extra=journal_context({"MESSAGE_ID": DATABRIDGE_TENDER_PROCESS},
                                                {"TENDER_ID": tender['id']}))
-            self.filtered_tender_ids_queue.put(tender['id'])
+            self.put_tender_to_process(tender, backfill=direction == "backward")
+
+    def put_tender_to_process(self, tender, backfill=False):
+        if self.dedup_filter is not None and self.dedup_filter.seen((tender['id'], tender.get('dateModified'))):
+            logger.debug('Tender {} is already in queue'.format(tender['id']),
+                         extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {"TENDER_ID": tender['id']}))
+            return
+        self.process_tracker.schedule_tender(tender['id'], tender.get('dateModified'))
+        self.filtered_tender_ids_queue.put(tender['id'], backfill=backfill)
 
     def _start_jobs(self):
         return {'get_tenders_backward': spawn(self.get_tenders_backward),
@@ -133,3 +273,37 @@ class Scanner(BaseWorker):
         for name, job in self.immortal_jobs.items():
             if job.dead and not job.value:
                 self.revive_job(name)
+
+
+def prefetch(pages, size):
+    """Iterate pages in a separate greenlet, so that up to size of them are requested ahead of consumer"""
+    buffer = Queue(maxsize=size)
+
+    def fill_buffer():
+        try:
+            for page in pages:
+                buffer.put((page, None))
+        except Exception as e:
+            buffer.put((None, e))
+        else:
+            buffer.put((None, None))
+
+    job = spawn(fill_buffer)
+    try:
+        while True:
+            page, error = buffer.get()
+            if error is not None:
+                raise error
+            elif page is None:
+                return
+            yield page
+    finally:
+        job.kill()
+
+
+def checkpoint_key(direction):
+    return "scanner:{}_offset".format(direction)
+
+
+def shard_direction(lower, upper):
+    return "backward_{}_{}".format(lower, upper)
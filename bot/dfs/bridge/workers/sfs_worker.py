@@ -1,11 +1,15 @@
 # coding=utf-8
-from gevent import monkey, sleep
+from gevent import monkey
 
 monkey.patch_all()
 import logging.config
 
 from datetime import datetime
+from gevent import sleep, spawn
+from gevent.event import AsyncResult
+from gevent.pool import Pool
 
+from bot.dfs.bridge.sleep_change_value import TokenBucket
 from bot.dfs.bridge.workers.base_worker import BaseWorker
 from bot.dfs.tests.utils import generate_request_id
 
@@ -14,7 +18,8 @@ logger = logging.getLogger(__name__)
 
 class SfsWorker(BaseWorker):
     def __init__(self, sfs_client, sfs_reqs_queue, upload_to_api_queue, process_tracker, redis_db,
-                 services_not_available, sleep_change_value, delay=15):
+                 services_not_available, sleep_change_value, delay=15, sfs_rate_limiter=None,
+                 pool_size=1, sfs_quota=None, backlog_delay=60):
         super(SfsWorker, self).__init__(services_not_available)
         self.start_time = datetime.now()
 
@@ -27,39 +32,78 @@ class SfsWorker(BaseWorker):
         self.requests_db = redis_db
         self.sfs_client = sfs_client
         self.sleep_change_value = sleep_change_value
+        # only real submissions to SFS are limited, awards bound to existing requests are not
+        self.sfs_rate_limiter = sfs_rate_limiter or TokenBucket(60.0 / delay)
+        self.pool = Pool(pool_size)
+        self.sfs_quota = sfs_quota
+        self.backlog_delay = backlog_delay
+        # code -> AsyncResult set once the request for the code is found or registered by this process
+        self.in_flight = {}
 
     def send_sfs_request(self):
         while not self.exit:
             data = self.sfs_reqs_queue.get()
             logger.info(u"got data from edrpou_codes_queue: {}".format(data))
-            recent_reqs = self.requests_db.recent_requests_with(data.code)
-            logger.info("Recent requests: {}".format(recent_reqs))
-            if not recent_reqs:
-                self.process_new_request(data)
-            else:
-                self.process_existing_request(data, recent_reqs[0])
-            sleep(self.delay)
+            self.pool.spawn(self.process_request, data)
+
+    def process_request(self, data):
+        """Find a recent request for the code or register a new one and bind the award to it, all in one call to
+        the database; awards for a code which is being looked up by this process wait for the lookup and, if it
+        registered a new request, for the request to be sent, so that they are not bound to one which failed"""
+        if data.code in self.in_flight:
+            logger.info(u"Request for code {} is in flight, waiting for it".format(data.code))
+            self.in_flight[data.code].get()
+            return self.process_request(data)
+        in_flight = self.in_flight[data.code] = AsyncResult()
+        request_id = status = None
+        try:
+            day, allowance = self.sfs_quota.current_allowance() if self.sfs_quota else (None, None)
+            request_id, status = self.requests_db.find_or_create_request(data, generate_request_id(), day, allowance)
+            logger.info(u"Request for {}: {} ({})".format(data, request_id, status))
+            if status == "new":
+                self.process_new_request(data, request_id, day if allowance is not None else None)
+        finally:
+            del self.in_flight[data.code]
+            in_flight.set(request_id)
+        if status == "quota":
+            logger.info(u"SFS quota is exhausted, putting {} to backlog".format(data))
+            self.requests_db.add_to_backlog(data)
+        elif status != "new":
+            self.process_existing_request(data, request_id)
 
-    def process_new_request(self, data):
-        """Make a new request, bind award in question to it"""
-        logger.info(u"Processing new request: {}".format(data))
-        request_id = generate_request_id()
+    def process_new_request(self, data, request_id, day=None):
+        """Send the request registered for the award to SFS. If it can't be sent, the request is removed together
+        with the awards bound to it and given back to the count of the day it was counted on, and the award is put
+        back to sfs_reqs_queue"""
+        logger.info(u"Processing new request: {};\t{}".format(data, request_id))
         data.file_content['meta']['sourceRequests'].append(request_id)
-        response = self.sfs_client.post(data, "", "", request_id)  # TODO: Here be answer from SFS
-        self.requests_db.add_sfs_request(request_id, {"code": data.code, "tender_id": data.tender_id,
-                                                      "name": data.name, "response": "placeholder"})
-        self.requests_db.add_award(data.tender_id, data.award_id, request_id, data)
+        self.sfs_rate_limiter.acquire()
+        try:
+            response = self.sfs_client.post(data, "", "", request_id)  # TODO: Here be answer from SFS
+        except Exception as e:
+            logger.warning(u"Failed to send request {} for {}. Message {}".format(request_id, data, e.message))
+            data.file_content['meta']['sourceRequests'].remove(request_id)
+            self.requests_db.cancel_request(request_id, data.code, day)
+            # workers must not block on full queue, which only the sender waiting for them could empty
+            spawn(self.sfs_reqs_queue.put, data)
 
     def process_existing_request(self, data, existing_request_id):
+        """Load the answer which is already there for the request the award is bound to into Central Database"""
         logger.info(u"Processing existing request: {};\t{}".format(data, existing_request_id))
-        """bind award to existing request, load the answer which is already there into Central Database"""
-        completed_reqs = self.requests_db.recent_complete_requests_with(data.code)
-        if completed_reqs:  # this way we upload the completed request, not pending one
-            self.requests_db.add_award(data.tender_id, data.award_id, completed_reqs[0], data)
-            self.upload_to_api_queue.put((data, self.requests_db.get_request(completed_reqs[0])))
-        else:  # this way we upload receipt from existing request into the award
-            self.requests_db.add_award(data.tender_id, data.award_id, existing_request_id, data)
-            self.upload_to_api_queue.put((data, self.requests_db.get_request(existing_request_id)))
+        self.upload_to_api_queue.put((data, self.requests_db.get_request(existing_request_id, data.code)))
+
+    def process_backlog(self):
+        """Retry awards held back while the SFS quota was exhausted, oldest first"""
+        while not self.exit:
+            data = self.requests_db.pop_backlog() if self.sfs_quota.available() else None
+            if data is None:
+                sleep(self.backlog_delay)
+            else:
+                logger.info(u"got data from backlog: {}".format(data))
+                self.pool.spawn(self.process_request, data)
 
     def _start_jobs(self):
-        return {"send_sfs_request": self.send_sfs_request()}
+        jobs = {"send_sfs_request": spawn(self.send_sfs_request)}
+        if self.sfs_quota:
+            jobs["process_backlog"] = spawn(self.process_backlog)
+        return jobs
@@ -25,8 +25,7 @@ config = {
             'cache_host': '127.0.0.1',
             'cache_port': '16379',
             'time_to_live': 1800,
-            'delay': 1,
-            'time_to_live_negative': 120
+            'delay': 1
         }
 }
 
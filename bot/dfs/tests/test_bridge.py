@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 import os
 
+from uuid import uuid4
+
 from base import BaseServersTest, config
 from bot.dfs.bridge.bridge import EdrDataBridge
+from bot.dfs.bridge.data import Data
 from mock import MagicMock, patch
 from openprocurement_client.client import TendersClient, TendersClientSync
 from restkit import RequestError
@@ -49,6 +52,7 @@ class TestBridgeWorker(BaseServersTest):
         self.worker.sfs_reqs_worker = sfs_reqs_worker
         self.worker.upload_file_to_doc_service = upload_file_to_doc_service
         self.worker.upload_file_to_tender = upload_file_to_tender
+        self.worker.requests_compactor = MagicMock(return_value=5)
 
         self.worker._start_jobs()
         # check that all jobs were started
@@ -63,6 +67,7 @@ class TestBridgeWorker(BaseServersTest):
         self.assertEqual(self.worker.jobs['sfs_reqs_worker'], 2)
         self.assertEqual(self.worker.jobs['upload_file_to_doc_service'], 3)
         self.assertEqual(self.worker.jobs['upload_file_to_tender'], 4)
+        self.assertEqual(self.worker.jobs['requests_compactor'], 5)
 
     @patch('gevent.sleep')
     def test_bridge_run(self, sleep):
@@ -151,3 +156,24 @@ class TestBridgeWorker(BaseServersTest):
         self.worker.jobs = {"test": MagicMock(dead=MagicMock(return_value=True))}
         self.worker.revive_job("test")
         self.assertEqual(self.worker.jobs['test'].dead, False)
+
+
+class TestBridgeRequests(BaseServersTest):
+    @patch('bot.dfs.bridge.bridge.RequestsToSfs')
+    def setUp(self, requests_to_sfs):
+        super(TestBridgeRequests, self).setUp()
+        self.worker = EdrDataBridge(config)
+
+    def tearDown(self):
+        super(TestBridgeRequests, self).tearDown()
+        self.redis.flushall()
+
+    def test_award_with_code_of_pending_request_reuses_it(self):
+        """ time_range is not configured in tests, so this checks the default of the bridge """
+        first = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+        second = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 123}})
+        self.assertEqual(self.worker.request_db.find_or_create_request(first, "1"), ("1", "new"))
+        self.assertEqual(self.worker.request_db.find_or_create_request(second, "2"), ("1", "pending"))
+        self.assertEqual(sorted(self.worker.request_db.get_tenders_of_request("1", "12345678"),
+                                key=lambda data: data.doc_id()),
+                         [first, second])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mock import MagicMock, patch
+
+from bot.dfs.bridge import codec
+
+DATA = {"tender_id": "111", "name": u"ТОВ «Компанія» / Ёё'\"", "file_content": {"meta": {"sourceRequests": ["req-1"]}}}
+
+
+class TestCodec(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(codec.loads(codec.dumps(DATA)), DATA)
+
+    def test_backends_round_trip(self):
+        for name, loads, dumps in codec.installed_backends():
+            self.assertEqual(loads(dumps(DATA)), DATA, name)
+            self.assertEqual(loads(dumps(DATA))["name"], DATA["name"], name)
+
+    def test_backends_ensure_ascii(self):
+        """ Non-ASCII characters are escaped, so every backend dumps the same ASCII str """
+        for name, loads, dumps in codec.installed_backends():
+            dumped = dumps(DATA)
+            self.assertIsInstance(dumped, str, name)
+            dumped.decode('ascii')
+            self.assertIn('\\u041a', dumped, name)
+
+    def test_backends_load_utf8(self):
+        """ API responses are UTF-8 bytes with non-ASCII characters unescaped """
+        body = u'{"data": {"name": "ТОВ «Компанія»"}}'.encode('utf-8')
+        for name, loads, dumps in codec.installed_backends():
+            self.assertEqual(loads(body), {"data": {"name": u"ТОВ «Компанія»"}}, name)
+
+    @patch('bot.dfs.bridge.codec.import_module')
+    def test_fallback_to_simplejson(self, import_module):
+        import_module.side_effect = ImportError()
+        name, loads, dumps = codec.load_backend()
+        self.assertEqual(name, 'simplejson')
+        self.assertEqual(loads(dumps({"id": 1})), {"id": 1})
+        self.assertEqual([call[0][0] for call in import_module.call_args_list], list(codec.FAST_BACKENDS))
+
+    def test_named_backend(self):
+        name, loads, dumps = codec.load_backend('simplejson')
+        self.assertEqual(name, 'simplejson')
+        self.assertEqual(loads(dumps(DATA)), DATA)
+        with self.assertRaises(ImportError):
+            codec.load_backend('nosuchjson')
+
+    @patch('bot.dfs.bridge.codec.import_module')
+    def test_fast_backend(self, import_module):
+        module = import_module.return_value = MagicMock()
+        name, loads, dumps = codec.load_backend()
+        self.assertEqual(name, codec.FAST_BACKENDS[0])
+        import_module.assert_called_once_with(codec.FAST_BACKENDS[0])
+        self.assertIs(loads, module.loads)
+        self.assertEqual(dumps(DATA), module.dumps.return_value)
+        module.dumps.assert_called_once_with(DATA, ensure_ascii=True)
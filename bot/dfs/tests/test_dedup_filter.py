@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mock import patch
+
+from bot.dfs.bridge.dedup_filter import DedupFilter
+
+
+class TestDedupFilter(unittest.TestCase):
+    def setUp(self):
+        self.dedup_filter = DedupFilter(capacity=2, window=10)
+
+    def test_seen(self):
+        self.assertFalse(self.dedup_filter.seen("111"))
+        self.assertTrue(self.dedup_filter.seen("111"))
+        self.assertFalse(self.dedup_filter.seen("222"))
+        self.assertEqual(self.dedup_filter.hit_rate(), 1 / 3.0)
+
+    def test_capacity(self):
+        for key in ("111", "222", "333"):
+            self.assertFalse(self.dedup_filter.seen(key))
+        self.assertEqual(len(self.dedup_filter), 2)
+        self.assertFalse(self.dedup_filter.seen("111"))
+
+    def test_capacity_evicts_least_recently_seen(self):
+        self.assertFalse(self.dedup_filter.seen("111"))
+        self.assertFalse(self.dedup_filter.seen("222"))
+        self.assertTrue(self.dedup_filter.seen("111"))
+        self.assertFalse(self.dedup_filter.seen("333"))
+        self.assertTrue(self.dedup_filter.seen("111"))
+        self.assertFalse(self.dedup_filter.seen("222"))
+
+    @patch('bot.dfs.bridge.dedup_filter.time')
+    def test_window(self, time_mock):
+        time_mock.return_value = 100
+        self.assertFalse(self.dedup_filter.seen("111"))
+        time_mock.return_value = 109
+        self.assertTrue(self.dedup_filter.seen("111"))
+        time_mock.return_value = 110
+        self.assertFalse(self.dedup_filter.seen("111"))
+
+    def test_hit_rate_without_lookups(self):
+        self.assertEqual(self.dedup_filter.hit_rate(), 0.0)
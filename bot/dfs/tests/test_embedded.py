@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import date
+from thread import get_ident
+from time import time
+
+from mock import patch
+
+from bot.dfs.bridge.caching import Db
+from bot.dfs.bridge.data import Data
+from bot.dfs.bridge.embedded import SqliteStore, ThreadedStore
+from bot.dfs.bridge.requests_db import PENDING_CODES_KEY, RequestsDb
+
+config = {
+    "main": {
+        "cache_backend": "sqlite",
+        "cache_path": ":memory:"
+    }
+}
+
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        self.store = SqliteStore(":memory:")
+
+    def test_strings(self):
+        self.assertIsNone(self.store.get("key"))
+        self.assertTrue(self.store.set("key", u"значення"))
+        self.assertEqual(self.store.get("key"), u"значення".encode("utf-8"))
+        self.assertIsNone(self.store.set("key", "other", nx=True))
+        self.assertTrue(self.store.exists("key"))
+        self.assertEqual(self.store.delete("key", "missing"), 1)
+        self.assertFalse(self.store.exists("key"))
+
+    def test_expire(self):
+        with patch("bot.dfs.bridge.embedded.time") as mocked_time:
+            mocked_time.return_value = 1000
+            self.store.set("key", "value", ex=10)
+            self.assertEqual(self.store.ttl("key"), 10)
+            mocked_time.return_value = 1010
+            self.assertIsNone(self.store.get("key"))
+            self.assertEqual(self.store.ttl("key"), -2)
+
+    def test_purge_expired(self):
+        with patch("bot.dfs.bridge.embedded.time") as mocked_time:
+            mocked_time.return_value = 1000
+            self.store.set("key", "value", ex=10)
+            self.store.sadd("set", "1")
+            self.store.expire("set", 10)
+            mocked_time.return_value = 1030
+            self.store.set("other", "value")
+            mocked_time.return_value = 1070
+            self.store.set("other", "value")
+        for table in ("strings", "sets", "expires"):
+            self.assertEqual(self.store.connection.execute(
+                "SELECT key FROM {} WHERE key IN ('key', 'set')".format(table)).fetchall(), [])
+
+    def test_incr(self):
+        self.assertEqual(self.store.incr("counter"), 1)
+        self.assertEqual(self.store.incr("counter"), 2)
+        self.assertEqual(self.store.decr("counter"), 1)
+        self.assertEqual(self.store.get("counter"), "1")
+
+    def test_hashes(self):
+        self.store.hmset("hash", {"code": "12345678", "status": "pending"})
+        self.assertEqual(self.store.hset("hash", "status", "complete"), 0)
+        self.assertEqual(self.store.hget("hash", "status"), "complete")
+        self.assertEqual(self.store.hgetall("hash"), {"code": "12345678", "status": "complete"})
+        self.assertEqual(self.store.hgetall("missing"), {})
+        self.assertEqual(self.store.hmget("hash", ["code", "missing"]), ["12345678", None])
+        self.assertEqual(self.store.hdel("hash", "status", "missing"), 1)
+        self.assertEqual(self.store.hgetall("hash"), {"code": "12345678"})
+
+    def test_sets(self):
+        self.assertEqual(self.store.sadd("set", "1", "2", "2"), 2)
+        self.assertEqual(self.store.srem("set", "1", "3"), 1)
+        self.assertEqual(self.store.smembers("set"), {"2"})
+        self.assertEqual(list(self.store.sscan_iter("set")), ["2"])
+        self.store.srem("set", "2")
+        self.assertFalse(self.store.exists("set"))
+
+    def test_sorted_sets(self):
+        self.assertEqual(self.store.zadd("zset", 3, "c", 1, "a", 2, "b"), 3)
+        self.assertEqual(self.store.zrangebyscore("zset", 1, 2), ["a", "b"])
+        self.assertEqual(self.store.zrangebyscore("zset", "-inf", "+inf", start=1, num=1), ["b"])
+        self.assertEqual(self.store.zscore("zset", "c"), 3)
+        self.assertEqual(self.store.zrem("zset", "a"), 1)
+        self.assertEqual(list(self.store.zscan_iter("zset")), [("b", 2), ("c", 3)])
+        self.assertEqual(self.store.zrange("zset", 0, -1), ["b", "c"])
+        self.assertEqual(self.store.zcard("zset"), 2)
+
+    def test_zrangebylex(self):
+        self.store.zadd("zset", 0, "1:a", 0, "1:b", 0, "12:a", 0, "2:a")
+        self.assertEqual(self.store.zrangebylex("zset", "[1:", "(1;"), ["1:a", "1:b"])
+        self.assertEqual(self.store.zrangebylex("zset", "(1:a", "+"), ["1:b", "2:a"])
+        self.assertEqual(self.store.zrangebylex("zset", "-", "[1:a"), ["12:a", "1:a"])
+
+    def test_lists(self):
+        self.store.rpush("list", "1", "2")
+        self.assertEqual(self.store.llen("list"), 2)
+        self.assertEqual(self.store.lpop("list"), "1")
+        self.assertEqual(self.store.lpop("list"), "2")
+        self.assertIsNone(self.store.lpop("list"))
+
+    def test_scan_iter(self):
+        self.store.set("requests:1", "1")
+        self.store.sadd("requests:pending", "1")
+        self.store.set("other", "1")
+        self.assertEqual(list(self.store.scan_iter("requests:*")), ["requests:1", "requests:pending"])
+
+    def test_pipeline(self):
+        pipe = self.store.pipeline()
+        pipe.sadd("set", "1")
+        pipe.execute_command("MEMORY", "USAGE", "set")
+        pipe.incr("counter")
+        results = pipe.execute(raise_on_error=False)
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 1)
+
+    def test_pipeline_is_atomic(self):
+        pipe = self.store.pipeline()
+        pipe.sadd("set", "1")
+        pipe.execute_command("MEMORY", "USAGE", "set")
+        with self.assertRaises(ValueError):
+            pipe.execute()
+        self.assertFalse(self.store.exists("set"))
+
+
+class TestThreadedStore(unittest.TestCase):
+    def setUp(self):
+        self.store = ThreadedStore(SqliteStore(":memory:"))
+
+    def test_calls_run_in_pool(self):
+        self.assertNotEqual(self.store.pool.apply(get_ident), get_ident())
+        self.store.set("key", "value")
+        self.assertEqual(self.store.get("key"), "value")
+        self.assertEqual(list(self.store.scan_iter("k*")), ["key"])
+        self.assertEqual(self.store.pipeline().sadd("set", "1").incr("counter").execute(), [1, 1])
+        run = self.store.register_script("", lambda store, keys, args: store.get(keys[0]))
+        self.assertEqual(run(keys=["key"]), "value")
+
+    def test_pipeline_is_atomic(self):
+        pipe = self.store.pipeline()
+        pipe.sadd("set", "1")
+        pipe.execute_command("MEMORY", "USAGE", "set")
+        with self.assertRaises(ValueError):
+            pipe.execute()
+        self.assertFalse(self.store.exists("set"))
+
+
+class TestRequestsDbOnSqlite(unittest.TestCase):
+    def setUp(self):
+        self.db = Db(config)
+        self.requests_db = RequestsDb(self.db)
+
+    def test_db_init(self):
+        self.assertEqual(self.db._backend, "sqlite")
+        self.assertEqual(self.db._db_name, ":memory:")
+        self.db.put("111", "test data")
+        self.assertEqual(self.db.get("111"), "test data")
+
+    def test_db_default_backend(self):
+        db = Db({"main": {"cache_path": ":memory:"}})
+        self.assertEqual(db._backend, "sqlite")
+        self.assertEqual(RequestsDb(db).migrate_code_indexes(), 0)
+
+    def test_db_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Db({"main": {"cache_backend": "memcached"}})
+
+    def test_requests(self):
+        self.requests_db.add_sfs_request("1", {"status": "pending", "code": "12345678"})
+        self.assertEqual(self.requests_db.get_pending_requests(), {"1": {"status": "pending", "code": "12345678"}})
+        self.assertEqual(self.requests_db.recent_requests_with("12345678"), ["1"])
+        self.requests_db.complete_request("1", "12345678")
+        self.assertEqual(self.requests_db.recent_complete_requests_with("12345678"), ["1"])
+        self.assertEqual(self.requests_db.get_pending_requests(), {})
+
+    def test_find_or_create_request(self):
+        day = date(2017, 10, 10)
+        data = Data("1", "1", "12345678", "comname", {"meta": {"id": 1}})
+        other = Data("2", "1", "87654321", "comname", {"meta": {"id": 2}})
+        self.assertEqual(self.requests_db.find_or_create_request(data, "1", day, 1), ("1", "new"))
+        self.assertEqual(self.requests_db.find_or_create_request(data, "2", day, 1), ("1", "pending"))
+        self.assertEqual(self.requests_db.find_or_create_request(other, "3", day, 1), (None, "quota"))
+        self.assertEqual(self.requests_db.daily_requests(day), 1)
+        self.assertEqual(self.requests_db.get_tenders_of_request("1", "12345678"), [data])
+
+    def test_expire_requests(self):
+        data = Data("1", "1", "12345678", "comname", {"meta": {"id": 1}})
+        self.requests_db.find_or_create_request(data, "1")
+        [(requests, pending, bindings, size)] = self.requests_db.expire_requests(time() + 1)
+        self.assertEqual((requests, pending, bindings), (1, 1, 1))
+        self.assertGreater(size, 0)
+        # the pending index keeps the code until iter_pending_requests finds it stale
+        self.assertEqual(list(self.db.scan_iter()), [PENDING_CODES_KEY])
@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
+import shlex
+from datetime import date
+from time import time
 from uuid import uuid4
 
-from base import BaseServersTest
+from mock import MagicMock
+
+from base import BaseServersTest, config
+from bot.dfs.bridge.caching import Db
 from bot.dfs.bridge.data import Data
 from json import loads, dumps
-from bot.dfs.bridge.requests_db import RequestsDb, award_key
+from bot.dfs.bridge.requests_db import (RequestsDb, CODES_KEY, PENDING_CODES_KEY, code_dates_key, code_owners_key,
+                                        code_pending_key, request_key)
 
 
 class TestRequestsDb(BaseServersTest):
@@ -13,36 +20,63 @@ class TestRequestsDb(BaseServersTest):
     def setUp(self):
         super(TestRequestsDb, self).setUp()
         self.requests_db = RequestsDb(self.db)
+        # two databases of the test server stand for two nodes
+        self.sharded_db = Db({'main': dict(config['main'], cache_nodes="127.0.0.1:{0}/1,127.0.0.1:{0}/2".format(
+            config['main']['cache_port']))})
+        self.sharded_requests_db = RequestsDb(self.sharded_db)
 
     def tearDown(self):
         del self.requests_db
+        self.redis.flushall()
 
     def test_add_request(self):
         req_data = {"status": "pending", "tender_id": "111", "code": "222"}
         self.requests_db.add_sfs_request("1", req_data)
-        self.assertEqual(self.redis.hgetall("requests:1"), req_data)
-        self.assertEqual(self.redis.smembers("requests:pending"), set("1", ))
+        self.assertEqual(self.redis.hgetall(request_key("222", "1")), req_data)
+        self.assertEqual(self.redis.smembers(code_pending_key("222")), {"1"})
+        self.assertEqual(self.redis.zrange(PENDING_CODES_KEY, 0, -1), ["222"])
 
     def test_get_pending_requests(self):
         req_data = {"status": "pending", "tender_id": "111", "code": "222"}
         self.requests_db.add_sfs_request("1", req_data)
         self.assertEqual(self.requests_db.get_pending_requests(), {"1": req_data})
 
+    def test_iter_pending_requests_drops_codes_without_pending(self):
+        self.requests_db.add_sfs_request("1", {"status": "pending", "code": "111"})
+        self.requests_db.add_sfs_request("2", {"status": "pending", "code": "222"})
+        self.requests_db.complete_request("1", "111")
+        self.requests_db.complete_request("2", "222")
+        self.redis.zadd(PENDING_CODES_KEY, 1, "111")
+        self.assertEqual(self.requests_db.get_pending_requests(), {})
+        self.assertEqual(self.redis.zrange(PENDING_CODES_KEY, 0, -1), ["222"])
+
+    def test_iter_pending_requests(self):
+        reqs_to_add = {str(i): {"status": "pending", "tender_id": "111", "code": str(i)} for i in range(5)}
+        for request_id, req_data in reqs_to_add.items():
+            self.requests_db.add_sfs_request(request_id, req_data)
+        self.requests_db.complete_request("3", "3")
+        del reqs_to_add["3"]
+        pending = self.requests_db.iter_pending_requests(batch_size=2)
+        self.assertEqual(next(pending)[1]["status"], "pending")
+        self.assertEqual(len(dict(pending)), 3)
+        self.assertEqual(dict(self.requests_db.iter_pending_requests(batch_size=2)), reqs_to_add)
+
     def test_complete_request(self):
         req_data = {"status": "pending", "tender_id": "111", "code": "222"}
         self.requests_db.add_sfs_request("1", req_data)
-        self.requests_db.complete_request("1")
-        self.assertEqual(self.redis.hgetall("requests:1")['status'], "complete")
-        self.assertEqual(self.redis.smembers("requests:pending"), set())
+        self.requests_db.complete_request("1", "222")
+        self.assertEqual(self.redis.hgetall(request_key("222", "1"))['status'], "complete")
+        self.assertEqual(self.redis.smembers(code_pending_key("222")), set())
+        self.assertEqual(self.requests_db.complete_requests_with("222"), ["1"])
 
     def test_add_award(self):
         tender_id = uuid4().hex
         award_id = uuid4().hex
         request_id = uuid4().hex
-        data = Data(tender_id, award_id)
+        data = Data(tender_id, award_id, "12345678", "comname", {"meta": {"id": 122}})
         self.requests_db.add_award(tender_id, award_id, request_id, data)
-        self.assertEqual(self.redis.hgetall(award_key(tender_id, award_id)), {"request_id": request_id,
-                                                                              "data": data.db_dump()})
+        self.assertEqual(self.redis.hget(code_owners_key("12345678"), "{}:{}".format(tender_id, award_id)), request_id)
+        self.assertEqual(self.requests_db.get_tenders_of_request(request_id, "12345678"), [data])
 
     def test_requests_within_range(self):
         reqs_to_add = {uuid4().hex: {"status": "pending", "code": uuid4().hex} for _ in range(4)}
@@ -57,5 +91,248 @@ class TestRequestsDb(BaseServersTest):
         request_id = uuid4().hex
         data = Data(tender_id, award_id, "12345678", "comname", {"meta": {"id": 122}})
         self.requests_db.add_award(tender_id, award_id, request_id, data)
-        self.assertEqual(self.requests_db.get_tenders_of_request(request_id), [data])
+        self.assertEqual(self.requests_db.get_tenders_of_request(request_id, "12345678"), [data])
+        self.assertEqual(self.requests_db.get_tenders_of_request(request_id, "87654321"), [])
+
+    def test_get_tenders_of_request_bulk(self):
+        request_id = uuid4().hex
+        awards = [Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": i}}) for i in range(2500)]
+        for data in awards:
+            self.requests_db.add_award(data.tender_id, data.award_id, request_id, data)
+        tenders = self.requests_db.get_tenders_of_request(request_id, "12345678")
+        self.assertEqual(sorted(tenders, key=lambda data: data.doc_id()), awards)
+        self.assertEqual(self.requests_db.get_tenders_of_request(uuid4().hex, "12345678"), [])
+
+    def test_find_or_create_request(self):
+        for db, requests_db in ((self.db, self.requests_db), (self.sharded_db, self.sharded_requests_db)):
+            data = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+            self.assertEqual(requests_db.find_or_create_request(data, "1"), ("1", "new"))
+            self.assertEqual(db.hgetall(request_key("12345678", "1")), {"code": "12345678", "tender_id": data.tender_id,
+                                                                        "name": "comname", "response": "placeholder"})
+            self.assertEqual(db.smembers(code_pending_key("12345678")), {"1"})
+            self.assertEqual(requests_db.recent_requests_with("12345678"), ["1"])
+            self.assertEqual([code for code, _ in db.db.zscan_iter(CODES_KEY)], ["12345678"])
+            self.assertEqual([code for code, _ in db.db.zscan_iter(PENDING_CODES_KEY)], ["12345678"])
+            self.assertEqual(requests_db.get_tenders_of_request("1", "12345678"), [data])
+            other = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 123}})
+            self.assertEqual(requests_db.find_or_create_request(other, "2"), ("1", "pending"))
+            self.assertEqual(db.hget(code_owners_key("12345678"), "{}:{}".format(other.tender_id, other.award_id)), "1")
+            self.assertEqual(db.hgetall(request_key("12345678", "2")), {})
+            db.db.flushall()
+
+    def test_find_or_create_request_source_requests(self):
+        """Award which registers the request is saved with the request among its sourceRequests"""
+        for db, requests_db in ((self.db, self.requests_db), (self.sharded_db, self.sharded_requests_db)):
+            data = Data("t1", "a", "12345678", "comname", {"meta": {"id": 122, "sourceRequests": []}})
+            other = Data("t2", "a", "12345678", "comname", {"meta": {"id": 123, "sourceRequests": []}})
+            self.assertEqual(requests_db.find_or_create_request(data, "1"), ("1", "new"))
+            self.assertEqual(requests_db.find_or_create_request(other, "2"), ("1", "pending"))
+            self.assertEqual(data.file_content["meta"]["sourceRequests"], [])
+            tenders = sorted(requests_db.get_tenders_of_request("1", "12345678"), key=lambda award: award.tender_id)
+            self.assertEqual([award.file_content["meta"]["sourceRequests"] for award in tenders], [["1"], []])
+            db.db.flushall()
+
+    def test_cancel_request(self):
+        day = date(2017, 10, 10)
+        for db, requests_db in ((self.db, self.requests_db), (self.sharded_db, self.sharded_requests_db)):
+            data = Data("t1", "a", "12345678", "comname", {"meta": {"id": 122}})
+            self.assertEqual(requests_db.find_or_create_request(data, "1", day, 1), ("1", "new"))
+            requests_db.cancel_request("1", "12345678", day)
+            self.assertEqual(requests_db.daily_requests(day), 0)
+            self.assertEqual(db.hgetall(request_key("12345678", "1")), {})
+            self.assertEqual(requests_db.get_tenders_of_request("1", "12345678"), [])
+            self.assertEqual(requests_db.find_or_create_request(data, "2", day, 1), ("2", "new"))
+            db.db.flushall()
+
+    def test_find_or_create_request_race(self):
+        """Request registered for the code by another bridge after the lookup of a sharded database is reused and
+        the day's count given back"""
+        day = date(2017, 10, 10)
+        data = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+        find_or_create = self.sharded_requests_db._find_or_create
+
+        def registered_by_other_bridge(keys, args):
+            if args[3] == 1:
+                self.sharded_db.zadd(code_dates_key("12345678"), args[0], "0")
+            return find_or_create(keys=keys, args=args)
+
+        self.sharded_requests_db._find_or_create = registered_by_other_bridge
+        self.assertEqual(self.sharded_requests_db.find_or_create_request(data, "1", day, 1), ("0", "pending"))
+        self.assertEqual(self.sharded_db.hgetall(request_key("12345678", "1")), {})
+        self.assertEqual(self.sharded_db.smembers(code_pending_key("12345678")), set())
+        self.assertEqual(self.sharded_requests_db.daily_requests(day), 0)
+        self.assertEqual(self.sharded_db.hget(code_owners_key("12345678"),
+                                              "{}:{}".format(data.tender_id, data.award_id)), "0")
+
+    def test_find_or_create_request_round_trips(self):
+        db = MagicMock(sharded=False)
+        db.register_script.return_value.return_value = ["1", "pending"]
+        requests_db = RequestsDb(db)
+        data = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+        self.assertEqual(requests_db.find_or_create_request(data, "2", date(2017, 10, 10), 5), ("1", "pending"))
+        self.assertEqual(db.register_script.return_value.call_count, 1)
+        self.assertEqual([name for name, _, _ in db.method_calls if not name.startswith("register_script")], [])
+
+    def test_script_touches_only_declared_keys(self):
+        """Every key the scripts read or write is passed in their KEYS, which cluster routing relies on"""
+        monitor = self.redis.connection_pool.get_connection("MONITOR")
+        monitor.send_command("MONITOR")
+        monitor.read_response()
+        day = date(2017, 10, 10)
+        for requests_db in (self.requests_db, self.sharded_requests_db):
+            for i, request_id in enumerate(["1", "2"]):
+                data = Data(uuid4().hex, uuid4().hex, str(12345678 + i), "comname", {"meta": {"id": i}})
+                requests_db.find_or_create_request(data, request_id, day, 5)
+            requests_db.complete_request("1", "12345678")
+            requests_db.get_tenders_of_request("1", "12345678")
+            requests_db.get_pending_requests()
+            list(requests_db.expire_requests(time() + 1))
+        self.redis.echo("done")
+        declared, touched = [], 0
+        while True:
+            line = monitor.read_response()
+            args = shlex.split(line.split("] ", 1)[1])
+            if args == ["ECHO", "done"]:
+                break
+            if args[0] == "EVALSHA":
+                declared = args[3:3 + int(args[2])]
+            elif " lua] " in line:
+                self.assertIn(args[1], declared, line)
+                touched += 1
+        monitor.disconnect()
+        self.assertGreater(touched, 0)
+
+    def test_find_or_create_request_zero_time_range(self):
+        requests_db = RequestsDb(self.db, time_range=0)
+        self.assertEqual(requests_db.time_range, 1)
+        data = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+        other = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 123}})
+        self.assertEqual(requests_db.find_or_create_request(data, "1"), ("1", "new"))
+        self.assertEqual(requests_db.find_or_create_request(other, "2"), ("1", "pending"))
+
+    def test_find_or_create_request_prefers_complete(self):
+        self.requests_db.add_sfs_request("1", {"status": "pending", "code": "12345678"})
+        self.requests_db.complete_request("1", "12345678")
+        self.requests_db.add_sfs_request("2", {"status": "pending", "code": "12345678"})
+        data = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+        self.assertEqual(self.requests_db.find_or_create_request(data, "3"), ("1", "complete"))
+
+    def test_find_or_create_request_quota(self):
+        day = date(2017, 10, 10)
+        for db, requests_db in ((self.db, self.requests_db), (self.sharded_db, self.sharded_requests_db)):
+            data = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+            other = Data(uuid4().hex, uuid4().hex, "87654321", "comname", {"meta": {"id": 123}})
+            self.assertEqual(requests_db.find_or_create_request(data, "1", day, 1), ("1", "new"))
+            self.assertEqual(requests_db.find_or_create_request(other, "2", day, 1), (None, "quota"))
+            self.assertEqual(requests_db.daily_requests(day), 1)
+            self.assertEqual(db.hgetall(request_key("87654321", "2")), {})
+            self.assertEqual(requests_db.find_or_create_request(data, "3", day, 1), ("1", "pending"))
+            self.assertEqual(requests_db.daily_requests(day), 1)
+            db.db.flushall()
+
+    def test_daily_requests(self):
+        day = date(2017, 10, 10)
+        self.assertEqual(self.requests_db.daily_requests(day), 0)
+        self.assertEqual(self.requests_db.add_daily_request(day), 1)
+        self.assertEqual(self.requests_db.add_daily_request(day), 2)
+        self.assertEqual(self.requests_db.daily_requests(day), 2)
+        self.assertEqual(self.requests_db.daily_requests(date(2017, 10, 11)), 0)
+        self.assertGreater(self.redis.ttl("requests:number:2017-10-10"), 0)
+
+    def test_backlog(self):
+        first = Data(uuid4().hex, uuid4().hex, "12345678", "comname", {"meta": {"id": 122}})
+        second = Data(uuid4().hex, uuid4().hex, "87654321", "comname", {"meta": {"id": 123}})
+        self.requests_db.add_to_backlog(first)
+        self.requests_db.add_to_backlog(second)
+        self.assertEqual(self.requests_db.backlog_size(), 2)
+        self.assertEqual(self.requests_db.pop_backlog(), first)
+        self.assertEqual(self.requests_db.pop_backlog(), second)
+        self.assertIsNone(self.requests_db.pop_backlog())
+
+    def test_recent_complete_requests_with(self):
+        code = uuid4().hex
+        self.requests_db.add_sfs_request("1", {"status": "pending", "code": code})
+        self.requests_db.add_sfs_request("2", {"status": "pending", "code": code})
+        self.assertEqual(self.requests_db.recent_complete_requests_with(code), [])
+        self.requests_db.complete_request("2", code)
+        self.assertEqual(self.requests_db.recent_complete_requests_with(code), ["2"])
+        self.assertEqual(self.requests_db.recent_requests_with(code), ["1", "2"])
+        self.assertEqual(self.redis.keys("recent:*"), [])
+
+    def test_migrate_code_indexes(self):
+        code = "12345678"
+        first = Data("t1", "a", code, "comname", {"meta": {"id": 1}})
+        second = Data("t2", "a", code, "comname", {"meta": {"id": 2}})
+        self.redis.hmset("requests:1", {"status": "complete", "code": code})
+        self.redis.hmset("requests:2", {"status": "pending", "code": code})
+        self.redis.zadd("requests:dates", time(), "1", time(), "2")
+        self.redis.sadd("requests:complete", "1")
+        self.redis.sadd("requests:pending", "2")
+        # t1:a was bound to request 1 and rebound to request 2 later
+        self.redis.hmset("tender:t1:a", {"request_id": "2", "data": first.db_dump()})
+        self.redis.hmset("tender:t2:a", {"request_id": "2", "data": second.db_dump()})
+        self.redis.sadd("tenders_of:1", "tender:t1:a")
+        self.redis.sadd("tenders_of:2", "tender:t1:a", "tender:t2:a")
+        self.redis.zadd("recent:requests:edrpou:{}".format(code), time(), "1")
+        self.redis.zadd("recent:complete:edrpou:{}:".format(code), time(), "1")
+        self.redis.sadd("requests:edrpou:{}".format(code), "1", "2")
+        # keys which are not reached from requests:dates are not the migration's to drop
+        self.redis.hmset("tender:t3:a", {"request_id": "3"})
+        self.redis.sadd("requests:edrpou:87654321", "3")
+        self.assertEqual(self.requests_db.migrate_code_indexes(batch_size=1), 2)
+        self.assertEqual(self.requests_db.get_request("1", code), {"status": "complete", "code": code})
+        self.assertEqual(self.requests_db.recent_requests_with(code), ["1", "2"])
+        self.assertEqual(self.requests_db.recent_complete_requests_with(code), ["1"])
+        self.assertEqual(self.requests_db.complete_requests_with(code), ["1"])
+        self.assertEqual(self.requests_db.get_pending_requests(), {"2": {"status": "pending", "code": code}})
+        self.assertEqual(self.requests_db.get_tenders_of_request("1", code), [first])
+        self.assertEqual(sorted(self.requests_db.get_tenders_of_request("2", code), key=lambda data: data.doc_id()),
+                         [first, second])
+        self.assertEqual(self.redis.hget(code_owners_key(code), "t1:a"), "2")
+        self.assertEqual(sorted(key for key in self.redis.keys("*") if "{" not in key),
+                         [CODES_KEY, PENDING_CODES_KEY, "requests:edrpou:87654321", "requests:index_version",
+                          "tender:t3:a"])
+        self.assertEqual(self.requests_db.migrate_code_indexes(), 0)
+
+    def test_writes_are_pipelined(self):
+        db = MagicMock()
+        requests_db = RequestsDb(db)
+        requests_db.add_sfs_request("1", {"status": "pending", "code": "222"})
+        requests_db.add_award("111", "333", "1", Data("111", "333", "12345678", "comname", {"meta": {"id": 122}}))
+        requests_db.complete_request("1", "222")
+        self.assertEqual(db.pipeline.return_value.execute.call_count, 2)
+        self.assertEqual(db.register_script.return_value.call_count, 1)
+        self.assertEqual([name for name, _, _ in db.method_calls
+                          if not name.startswith("pipeline") and not name.startswith("register_script")], [])
+
+    def test_expire_requests(self):
+        for i in range(3):
+            self.requests_db.add_sfs_request(str(i), {"status": "pending", "code": "12345678"})
+            data = Data("t{}".format(i), "a", "12345678", "comname", {"meta": {"id": i}})
+            self.requests_db.add_award(data.tender_id, data.award_id, str(i), data)
+        self.requests_db.complete_request("0", "12345678")
+        rebound = Data("t1", "a", "12345678", "comname", {"meta": {"id": 1}})
+        self.requests_db.add_award(rebound.tender_id, rebound.award_id, "2", rebound)
+        self.redis.zadd(code_dates_key("12345678"), 1, "0", 1, "1")
+        batches = list(self.requests_db.expire_requests(time() - 100, batch_size=1))
+        self.assertEqual([batch[:3] for batch in batches], [(1, 0, 1), (1, 1, 1)])
+        self.assertTrue(all(size > 0 for _, _, _, size in batches))
+        self.assertEqual(self.requests_db.recent_requests_with("12345678"), ["2"])
+        self.assertEqual(self.redis.smembers(code_pending_key("12345678")), {"2"})
+        self.assertEqual(self.requests_db.complete_requests_with("12345678"), [])
+        self.assertEqual(self.redis.hkeys(code_owners_key("12345678")), ["t1:a", "t2:a"])
+        self.assertEqual(sorted(self.requests_db.get_tenders_of_request("2", "12345678"),
+                                key=lambda data: data.doc_id()),
+                         [rebound, Data("t2", "a", "12345678", "comname", {"meta": {"id": 2}})])
+        self.assertEqual(self.requests_db.get_tenders_of_request("1", "12345678"), [])
+        self.assertEqual(self.redis.zrange(CODES_KEY, 0, -1), ["12345678"])
 
+    def test_expire_requests_drops_codes_without_requests(self):
+        for code in ("111", "222"):
+            self.requests_db.add_sfs_request("1", {"status": "pending", "code": code})
+        self.redis.zadd(CODES_KEY, 1, "111")
+        self.redis.zadd(code_dates_key("111"), 1, "1")
+        self.assertEqual([removed[:3] for removed in self.requests_db.expire_requests(time() - 100)], [(1, 1, 0)])
+        self.assertEqual(self.redis.zrange(CODES_KEY, 0, -1), ["222"])
+        self.assertEqual(self.requests_db.get_request("1", "111"), {})
+        self.assertEqual(self.requests_db.recent_requests_with("222"), ["1"])
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime
+
+from mock import MagicMock, patch
+
+from bot.dfs.bridge.constants import TZ
+from bot.dfs.bridge.sfs_quota import SfsQuota
+
+
+class TestSfsQuota(unittest.TestCase):
+    def setUp(self):
+        self.requests_db = MagicMock()
+        self.quota = SfsQuota(self.requests_db, daily_limit=90)
+
+    def test_allowance(self):
+        self.assertEqual(self.quota.allowance(TZ.localize(datetime(2017, 10, 10, 8, 0))), 0)
+        self.assertEqual(self.quota.allowance(TZ.localize(datetime(2017, 10, 10, 9, 0))), 0)
+        self.assertEqual(self.quota.allowance(TZ.localize(datetime(2017, 10, 10, 9, 6))), 1)
+        self.assertEqual(self.quota.allowance(TZ.localize(datetime(2017, 10, 10, 13, 30))), 45)
+        self.assertEqual(self.quota.allowance(TZ.localize(datetime(2017, 10, 10, 18, 0))), 90)
+        self.assertEqual(self.quota.allowance(TZ.localize(datetime(2017, 10, 10, 23, 0))), 90)
+
+    @patch('bot.dfs.bridge.sfs_quota.business_date_checker', MagicMock(return_value=True))
+    @patch('bot.dfs.bridge.sfs_quota.datetime')
+    def test_current_allowance(self, datetime_mock):
+        datetime_mock.now = MagicMock(return_value=TZ.localize(datetime(2017, 10, 10, 13, 30)))
+        self.assertEqual(self.quota.current_allowance(), (datetime(2017, 10, 10).date(), 45))
+
+    @patch('bot.dfs.bridge.sfs_quota.business_date_checker', MagicMock(return_value=False))
+    @patch('bot.dfs.bridge.sfs_quota.datetime')
+    def test_current_allowance_out_of_business_time(self, datetime_mock):
+        datetime_mock.now = MagicMock(return_value=TZ.localize(datetime(2017, 10, 14, 13, 30)))
+        self.assertEqual(self.quota.current_allowance(), (datetime(2017, 10, 14).date(), 0))
+
+    @patch('bot.dfs.bridge.sfs_quota.business_date_checker', MagicMock(return_value=True))
+    @patch('bot.dfs.bridge.sfs_quota.datetime')
+    def test_available(self, datetime_mock):
+        datetime_mock.now = MagicMock(return_value=TZ.localize(datetime(2017, 10, 10, 13, 30)))
+        self.requests_db.daily_requests.return_value = 44
+        self.assertTrue(self.quota.available())
+        self.requests_db.daily_requests.return_value = 45
+        self.assertFalse(self.quota.available())
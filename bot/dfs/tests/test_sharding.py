@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mock import MagicMock
+
+from bot.dfs.bridge.requests_db import code_dates_key, code_keys, code_pending_key, request_key
+from bot.dfs.bridge.sharding import ShardedRedis, key_slot
+
+
+class TestKeySlot(unittest.TestCase):
+    def test_key_slot(self):
+        self.assertEqual(key_slot("123456789"), 12739)
+        self.assertEqual(key_slot("foo{bar}{zap}"), key_slot("bar"))
+        self.assertEqual(key_slot(u"{}a"), key_slot("{}a"))
+        self.assertNotEqual(key_slot("{}a"), key_slot("a"))
+
+    def test_code_keys_share_slot(self):
+        self.assertEqual({key_slot(key) for key in code_keys("12345678") + [request_key("12345678", "1")]},
+                         {key_slot("12345678")})
+
+
+class TestShardedRedis(unittest.TestCase):
+    def setUp(self):
+        self.clients = [MagicMock(), MagicMock()]
+        self.sharded = ShardedRedis(self.clients)
+        self.first, self.second = code_pending_key("12345678"), code_pending_key("87654321")  # slots 4117 and 10867
+
+    def test_routing(self):
+        self.sharded.sadd(self.first, "1")
+        self.sharded.sadd(self.second, "2")
+        self.sharded.execute_command("MEMORY USAGE", self.second)
+        self.clients[0].sadd.assert_called_once_with(self.first, "1")
+        self.clients[1].sadd.assert_called_once_with(self.second, "2")
+        self.clients[1].execute_command.assert_called_once_with("MEMORY USAGE", self.second)
+        self.assertFalse(self.clients[0].execute_command.called)
+
+    def test_delete(self):
+        self.clients[0].delete.return_value = 1
+        self.clients[1].delete.return_value = 0
+        self.assertEqual(self.sharded.delete(self.first, self.second), 1)
+        self.clients[0].delete.assert_called_once_with(self.first)
+        self.clients[1].delete.assert_called_once_with(self.second)
+
+    def test_scan_iter(self):
+        self.clients[0].scan_iter.return_value = iter(["a"])
+        self.clients[1].scan_iter.return_value = iter(["b"])
+        self.assertEqual(list(self.sharded.scan_iter("*")), ["a", "b"])
+
+    def test_pipeline_keeps_order(self):
+        self.clients[0].pipeline.return_value.execute.return_value = [1, 2]
+        self.clients[1].pipeline.return_value.execute.return_value = [3]
+        pipe = self.sharded.pipeline(transaction=False)
+        pipe.sadd(self.first, "1")
+        pipe.sadd(self.second, "2")
+        pipe.smembers(self.first)
+        self.assertEqual(pipe.execute(), [1, 3, 2])
+        self.clients[0].pipeline.assert_called_once_with(False)
+        self.assertEqual(pipe.execute(), [])
+
+    def test_script(self):
+        script = self.sharded.register_script("return 1")
+        script(keys=[self.first, code_dates_key("12345678")], args=[1])
+        self.clients[0].register_script.return_value.assert_called_once_with(
+            keys=[self.first, code_dates_key("12345678")], args=[1])
+        with self.assertRaises(ValueError):
+            script(keys=[self.first, self.second])
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mock import patch
+
+from bot.dfs.bridge.sleep_change_value import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    @patch('bot.dfs.bridge.sleep_change_value.time')
+    def test_burst(self, mocked_time):
+        mocked_time.return_value = 0
+        bucket = TokenBucket(requests_per_minute=60, burst=3)
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+
+    @patch('bot.dfs.bridge.sleep_change_value.time')
+    def test_refill(self, mocked_time):
+        mocked_time.return_value = 0
+        bucket = TokenBucket(requests_per_minute=6, burst=2)
+        bucket.try_acquire()
+        bucket.try_acquire()
+        self.assertEqual(bucket.wait_time(), 10)
+        mocked_time.return_value = 10
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+    @patch('bot.dfs.bridge.sleep_change_value.time')
+    def test_refill_is_capped_by_burst(self, mocked_time):
+        mocked_time.return_value = 0
+        bucket = TokenBucket(requests_per_minute=60, burst=2)
+        mocked_time.return_value = 1000
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [True, True, False])
+
+    @patch('bot.dfs.bridge.sleep_change_value.sleep')
+    @patch('bot.dfs.bridge.sleep_change_value.time')
+    def test_acquire_waits(self, mocked_time, mocked_sleep):
+        mocked_time.return_value = 0
+        mocked_sleep.side_effect = lambda seconds: setattr(mocked_time, 'return_value', mocked_time.return_value + seconds)
+        bucket = TokenBucket(requests_per_minute=30, burst=1)
+        bucket.acquire()
+        bucket.acquire()
+        mocked_sleep.assert_called_once_with(2)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+
+monkey.patch_all()
+
+import unittest
+
+from gevent import spawn
+from gevent.queue import Empty, Full
+
+from bot.dfs.bridge.tender_queue import TenderQueue
+
+
+class TestTenderQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = TenderQueue(10, backfill_share=0.5)
+
+    def test_live_first(self):
+        self.queue.put("backfill", backfill=True)
+        self.queue.put("live")
+        self.assertEqual(self.queue.qsize(), 2)
+        self.assertEqual(self.queue.get(), "live")
+        self.assertEqual(self.queue.get(), "backfill")
+        self.assertEqual(self.queue.qsize(), 0)
+
+    def test_backfill_share(self):
+        for i in range(4):
+            self.queue.put("live{}".format(i))
+            self.queue.put("backfill{}".format(i), backfill=True)
+        self.assertEqual([self.queue.get() for _ in range(6)],
+                         ["live0", "live1", "backfill0", "live2", "live3", "backfill1"])
+
+    def test_peek(self):
+        self.queue.put("backfill", backfill=True)
+        self.assertEqual(self.queue.peek(), "backfill")
+        self.queue.put("live")
+        self.assertEqual(self.queue.get(), "backfill")
+        self.assertEqual(self.queue.peek(), "live")
+        self.assertEqual(self.queue.get(), "live")
+
+    def test_get_entry(self):
+        self.queue.put("backfill", backfill=True)
+        self.queue.put("live")
+        self.assertEqual(self.queue.get_entry(), ("live", False))
+        self.assertEqual(self.queue.get_entry(), ("backfill", True))
+
+    def test_empty(self):
+        with self.assertRaises(Empty):
+            self.queue.get(block=False)
+        with self.assertRaises(Empty):
+            self.queue.peek(timeout=0.01)
+
+    def test_get_blocks_until_put(self):
+        getter = spawn(self.queue.get)
+        self.queue.put("backfill", backfill=True)
+        self.assertEqual(getter.get(timeout=1), "backfill")
+
+    def test_maxsize_is_total(self):
+        queue = TenderQueue(2)
+        queue.put("live")
+        queue.put("backfill", backfill=True)
+        with self.assertRaises(Full):
+            queue.put("other", backfill=True, block=False)
+        with self.assertRaises(Full):
+            queue.put("other", timeout=0.01)
+        self.assertEqual(queue.get(), "live")
+        queue.put("other", block=False)
+        self.assertEqual(queue.qsize(), 2)
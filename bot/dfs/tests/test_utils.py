@@ -3,13 +3,14 @@ import subprocess
 from time import sleep
 from unittest import TestCase
 
-from bot.dfs.bridge.caching import Db, db_key
+from bot.dfs.bridge.caching import Db, date_modified_key, db_key, processed_key
 from bot.dfs.bridge.process_tracker import ProcessTracker
 from bot.dfs.bridge.utils import *
 from hypothesis import given
 from hypothesis.strategies import datetimes, integers
 from mock import MagicMock, patch
 from redis import StrictRedis
+from redis.connection import PythonParser
 
 config = {
     "main": {
@@ -52,6 +53,31 @@ class TestUtils(TestCase):
         self.assertEqual(self.db._db_name, 0)
         self.assertEqual(self.db._port, "16379")
         self.assertEqual(self.db._host, "127.0.0.1")
+        self.assertEqual(self.db.pool.max_connections, 50)
+        self.assertTrue(self.db.pool.connection_kwargs['socket_keepalive'])
+        self.assertEqual(self.db.pool.connection_kwargs['socket_timeout'], 5)
+
+    def test_db_pool_options(self):
+        db = Db({"main": dict(config["main"], cache_max_connections=2, cache_socket_timeout=1,
+                              cache_socket_keepalive=False, cache_hiredis=False)})
+        self.assertEqual(db.pool.max_connections, 2)
+        self.assertEqual(db.pool.connection_kwargs['socket_timeout'], 1)
+        self.assertFalse(db.pool.connection_kwargs['socket_keepalive'])
+        self.assertEqual(db.pool.connection_kwargs['parser_class'], PythonParser)
+        db.put("111", "test data")
+        self.assertEqual(db.get("111"), "test data")
+
+    def test_db_sharded_nodes(self):
+        db = Db({"main": dict(config["main"], cache_nodes="127.0.0.1:16379/1, 127.0.0.1/2")})
+        self.assertEqual(db._sharding, "client")
+        self.assertEqual(db.cache_nodes(), [("127.0.0.1", 16379, 1), ("127.0.0.1", 6379, 2)])
+        self.assertEqual([pool.connection_kwargs['db'] for pool in db.pools], [1, 2])
+        self.assertEqual(len(db.db.clients), 2)
+
+    def test_db_smembers(self):
+        self.assertEqual(self.db.smembers("111"), set())
+        self.db.sadd("111", "test data")
+        self.assertEqual(self.db.smembers("111"), {"test data"})
 
     def test_db_get(self):
         self.assertIsNone(self.db.get("111"))
@@ -194,3 +220,24 @@ class TestUtils(TestCase):
     def test_business_date_checker_free_time(self, datetime_mock):
         datetime_mock.now = MagicMock(return_value=datetime(2017, 10, 10, 06, 00, 00, 000000))
         self.assertFalse(business_date_checker())
+
+    def test_check_tender_modified(self):
+        self.assertTrue(self.process_tracker.check_tender_modified(self.tender_id, "2017-10-10T12:00:00+03:00"))
+        self.process_tracker.schedule_tender(self.tender_id, "2017-10-10T12:00:00+03:00")
+        self.process_tracker.set_tender_fetched(self.tender_id)
+        self.assertEqual(self.process_tracker.scheduled_tenders, {})
+        self.assertFalse(self.process_tracker.check_tender_modified(self.tender_id, "2017-10-10T12:00:00+03:00"))
+        self.assertTrue(self.process_tracker.check_tender_modified(self.tender_id, "2017-10-11T12:00:00+03:00"))
+        self.assertTrue(self.process_tracker.check_tender_modified(self.tender_id, None))
+
+    def test_set_tender_fetched_prefers_tender_date_modified(self):
+        self.process_tracker.schedule_tender(self.tender_id, "2017-10-10T12:00:00+03:00")
+        self.process_tracker.set_tender_fetched(self.tender_id, "2017-10-11T12:00:00+03:00")
+        self.assertEqual(self.redis.get(date_modified_key(self.tender_id)), "2017-10-11T12:00:00+03:00")
+
+    def test_check_processed_item_after_restart(self):
+        self.process_tracker.set_item(self.tender_id, self.award_id)
+        self.process_tracker.update_items_and_tender(self.tender_id, self.award_id, self.document_id)
+        self.assertTrue(ProcessTracker(self.db).check_processed_item(self.tender_id, self.award_id))
+        self.assertGreater(self.redis.ttl(processed_key(item_key(self.tender_id, self.award_id))),
+                           self.process_tracker.ttl)
@@ -8,6 +8,7 @@ import unittest
 import datetime
 
 from gevent.hub import LoopExit
+from gevent.pool import Pool
 from gevent.queue import Queue
 from mock import patch, MagicMock
 from time import sleep
@@ -22,6 +23,7 @@ from bot.dfs.bridge.constants import tender_status, AWARD_STATUS
 from bot.dfs.bridge.workers.filter_tender import FilterTenders
 from bot.dfs.bridge.utils import item_key
 from bot.dfs.bridge.process_tracker import ProcessTracker
+from bot.dfs.bridge.tender_queue import TenderQueue
 from bot.dfs.bridge.data import Data
 from bot.dfs.tests.utils import custom_sleep, generate_request_id, ResponseMock
 from bot.dfs.bridge.bridge import TendersClientSync
@@ -77,7 +79,7 @@ def generate_response():
 
 class TestFilterWorker(unittest.TestCase):
     def setUp(self):
-        self.filtered_tender_ids_queue = Queue(10)
+        self.filtered_tender_ids_queue = TenderQueue(10)
         self.edrpou_codes_queue = Queue(10)
         self.process_tracker = ProcessTracker()
         self.tender_id = uuid.uuid4().hex
@@ -229,6 +231,7 @@ class TestFilterWorker(unittest.TestCase):
         gevent_sleep.side_effect = custom_sleep
         filtered_tender_ids_queue = MagicMock()
         filtered_tender_ids_queue.peek.side_effect = [LoopExit(), self.tender_id]
+        filtered_tender_ids_queue.get_entry.return_value = (self.tender_id, False)
         self.client.request.return_value = self.response
         first_data = Data(self.tender_id, self.award_ids[0], CODES[0], "company_name",
                           {"meta": {"sourceRequests": [self.request_ids[0]]}})
@@ -286,7 +289,7 @@ class TestFilterWorker(unittest.TestCase):
     def test_412(self, gevent_sleep):
         gevent_sleep.side_effect = custom_sleep
         self.worker.kill()
-        filtered_tender_ids_queue = Queue(10)
+        filtered_tender_ids_queue = TenderQueue(10)
         filtered_tender_ids_queue.put('123')
         api_server_bottle = Bottle()
         api_server = WSGIServer(('127.0.0.1', 20604), api_server_bottle, log=None)
@@ -334,3 +337,164 @@ class TestFilterWorker(unittest.TestCase):
                                                                       "id": 12345678}}]}]}}
         response = MagicMock(body_string=MagicMock(return_value=dumps(res_json)))
         self.worker.process_response(response)
+
+    def test_process_response_sets_tender_fetched(self):
+        self.process_tracker.set_tender_fetched = MagicMock()
+        res_json = {"data": {"id": 1, "dateModified": "2017-10-10", "awards": []}}
+        response = MagicMock(body_string=MagicMock(return_value=dumps(res_json)))
+        self.worker.process_response(response)
+        self.process_tracker.set_tender_fetched.assert_called_once_with(1, "2017-10-10")
+
+    @patch('gevent.sleep')
+    def test_worker_pool(self, gevent_sleep):
+        """ Several fetchers process different tenders concurrently """
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        self.worker = FilterTenders.spawn(self.client, self.filtered_tender_ids_queue, self.edrpou_codes_queue,
+                                          self.process_tracker, self.sna, self.sleep_change_value, pool_size=2)
+        second_tender_id = uuid.uuid4().hex
+        self.filtered_tender_ids_queue.put(second_tender_id)
+        self.client.request.side_effect = [
+            ResponseMock({'X-Request-ID': self.request_ids[i]},
+                         munchify({'data': {'status': tender_status,
+                                            'id': tender_id,
+                                            'procurementMethodType': 'aboveThresholdEU',
+                                            'awards': [self.awards(i, i, AWARD_STATUS, CODES[0])]}}))
+            for i, tender_id in enumerate([self.tender_id, second_tender_id])]
+        self.assertItemsEqual([self.edrpou_codes_queue.get().tender_id for _ in range(2)],
+                              [self.tender_id, second_tender_id])
+        self.assertEqual(self.worker.pool.size, 2)
+        self.assertEqual(self.worker.tenders_in_process, set())
+
+    @patch('gevent.sleep')
+    def test_get_tender_puts_tender_back(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        self.filtered_tender_ids_queue.get()
+        self.worker.tenders_in_process.add(self.tender_id)
+        self.client.request.side_effect = [ResourceError(http_code=429)]
+        self.worker.get_tender(self.tender_id)
+        self.assertEqual(self.filtered_tender_ids_queue.get(timeout=1), self.tender_id)
+        self.assertEqual(self.worker.tenders_in_process, set())
+        self.assertEqual(self.sleep_change_value.time_between_requests, 1)
+
+    @patch('gevent.sleep')
+    def test_get_tender_keeps_backfill(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        self.filtered_tender_ids_queue.get()
+        self.client.request.side_effect = [ResourceError(http_code=429)]
+        self.worker.get_tender(self.tender_id, backfill=True)
+        self.assertEqual(self.filtered_tender_ids_queue.get_entry(timeout=1), (self.tender_id, True))
+
+    @patch('gevent.sleep')
+    def test_tender_queued_while_fetched(self, gevent_sleep):
+        """ Tender which comes while it is being fetched is fetched again, its feed dateModified is not recorded
+        by the running fetch """
+        gevent_sleep.side_effect = custom_sleep
+        fetching, fetched = event.Event(), event.Event()
+
+        def request(*args, **kwargs):
+            fetching.set()
+            fetched.wait()
+            return self.response
+
+        self.client.request.side_effect = request
+        self.process_tracker.set_tender_fetched = MagicMock()
+        self.worker.pool = Pool(2)
+        fetching.wait()
+        self.filtered_tender_ids_queue.put(self.tender_id, backfill=True)
+        sleep(0.1)
+        self.assertEqual(self.worker.tenders_to_refetch, {self.tender_id: True})
+        self.process_tracker.set_item = MagicMock()
+        fetched.set()
+        self.assertEqual(self.edrpou_codes_queue.get(timeout=1).tender_id, self.tender_id)
+        self.assertEqual(self.edrpou_codes_queue.get(timeout=1).tender_id, self.tender_id)
+        sleep(0.1)
+        self.assertEqual(self.client.request.call_count, 2)
+        self.process_tracker.set_tender_fetched.assert_called_once_with(self.tender_id, None)
+        self.assertEqual(self.worker.tenders_to_refetch, {})
+
+    @patch('gevent.sleep')
+    def test_get_tender_failed_unschedules_tender(self, gevent_sleep):
+        """ Tender which is not fetched and not put back does not keep its feed dateModified """
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        self.process_tracker.schedule_tender(self.tender_id, "2017-10-10")
+        self.client.request.return_value = ResponseMock({}, None, status_int=404)
+        self.worker.get_tender(self.tender_id)
+        self.assertEqual(self.process_tracker.scheduled_tenders, {})
+
+    @patch('gevent.sleep')
+    def test_worker_awards_only(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.awards_only = True
+        self.client.request.return_value = ResponseMock({'X-Request-ID': self.request_ids[0]},
+                                                        munchify({'data': [self.awards(0, 0, AWARD_STATUS, CODES[0])]}))
+        data = Data(self.tender_id, self.award_ids[0], CODES[0], "company_name",
+                    {"meta": {"sourceRequests": [self.request_ids[0]]}})
+        self.assertEqual(self.edrpou_codes_queue.get(), data)
+        self.assertTrue(self.client.request.call_args[1]['path'].endswith('/{}/awards'.format(self.tender_id)))
+
+    @patch('gevent.sleep')
+    def test_not_modified_tender(self, gevent_sleep):
+        """ Validators of processed response are sent with next request, 304 response is not processed """
+        gevent_sleep.side_effect = custom_sleep
+        cache = {}
+        self.worker.db = self.process_tracker._db = MagicMock(
+            get=MagicMock(side_effect=cache.get), has=MagicMock(return_value=False),
+            put=MagicMock(side_effect=lambda key, value, ex: cache.update({key: value})))
+        self.response.headers['ETag'] = '"etag"'
+        self.response.headers['Last-Modified'] = 'Tue, 10 Oct 2017 12:00:00 GMT'
+        self.client.request.side_effect = [self.response, ResponseMock({}, None, status_int=304)]
+        data = self.edrpou_codes_queue.get()
+        self.assertEqual(data.tender_id, self.tender_id)
+        self.process_tracker.update_items_and_tender(data.tender_id, data.award_id, "document_id")
+        self.filtered_tender_ids_queue.put(self.tender_id)
+        sleep(1)
+        headers = self.client.request.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"etag"')
+        self.assertEqual(headers['If-Modified-Since'], 'Tue, 10 Oct 2017 12:00:00 GMT')
+        self.assertEqual(self.client.request.call_count, 2)
+        self.assertEqual(self.edrpou_codes_queue.qsize(), 0)
+
+    @patch('gevent.sleep')
+    def test_validators_saved_after_awards_processed(self, gevent_sleep):
+        """ Tender is fetched without validators while its awards are in process """
+        gevent_sleep.side_effect = custom_sleep
+        cache = {}
+        self.worker.db = self.process_tracker._db = MagicMock(
+            get=MagicMock(side_effect=cache.get), has=MagicMock(return_value=False),
+            put=MagicMock(side_effect=lambda key, value, ex: cache.update({key: value})))
+        self.response.headers['ETag'] = '"etag"'
+        self.client.request.return_value = self.response
+        data = self.edrpou_codes_queue.get()
+        self.assertEqual(self.worker.conditional_headers(self.tender_id), {})
+        self.process_tracker.update_items_and_tender(data.tender_id, data.award_id, "document_id")
+        self.assertEqual(self.worker.conditional_headers(self.tender_id), {'If-None-Match': '"etag"'})
+
+    def test_conditional_headers_without_db(self):
+        self.assertEqual(self.worker.conditional_headers(self.tender_id), {})
+
+    def test_process_response_nothing_to_process(self):
+        """ Version of tender without awards to process is recorded as fetched, so it is not fetched again """
+        self.process_tracker.set_tender_fetched = MagicMock()
+        res_json = {"data": {"id": 1, "dateModified": "2017-10-10", "awards": [
+            {"status": "active", "id": 2, "bid_id": 1,
+             "documents": [{"documentType": "registerExtract"}],
+             "suppliers": [{"identifier": {"scheme": "UA-EDR", "legalName": "cname", "id": CODES[0]}}]}]}}
+        response = MagicMock(body_string=MagicMock(return_value=dumps(res_json)))
+        self.worker.process_response(response)
+        self.assertEqual(self.edrpou_codes_queue.qsize(), 0)
+        self.process_tracker.set_tender_fetched.assert_called_once_with(1, "2017-10-10")
+
+    def test_process_response_award_in_process(self):
+        """ Award which is already in process is not put into edrpou_codes_queue again """
+        self.process_tracker.set_item(self.tender_id, self.award_ids[0])
+        self.worker.process_response(self.response)
+        self.assertEqual(self.edrpou_codes_queue.qsize(), 0)
+
+    def test_process_response_award_processed(self):
+        self.process_tracker.processed_items[item_key(self.tender_id, self.award_ids[0])] = datetime.datetime.now()
+        self.worker.process_response(self.response)
+        self.assertEqual(self.edrpou_codes_queue.qsize(), 0)
@@ -22,7 +22,7 @@ class TestRequestForReferenceWorker(BaseServersTest):
     def setUp(self):
         super(TestRequestForReferenceWorker, self).setUp()
         self.sleep_change_value = APIRateController()
-        self.request_db = RequestsDb(self.redis)
+        self.request_db = RequestsDb(self.db)
         self.request_to_sfs = RequestsToSfs()
         self.request_ids = {'req1': {'code': '14360570'}, 'req2': {'code': '0013823'}}
         for key, value in self.request_ids.items():
@@ -61,7 +61,7 @@ class TestRequestForReferenceWorker(BaseServersTest):
     def test_check_incoming_correspondence(self):
         rfr = RequestForReference(self.reference_queue, self.request_to_sfs, self.request_db, self.sna,
                                   self.sleep_change_value)
-        self.assertIsNone(rfr.check_incoming_correspondence(self.request_ids))
+        self.assertIsNone(rfr.check_incoming_correspondence(self.request_ids.items()))
         # self.assertIsNone(self.reference_queue.get()[1])
         self.assertEqual(self.reference_queue.get(), ({"meta": {"id": "123"}}, []))
 
@@ -69,7 +69,7 @@ class TestRequestForReferenceWorker(BaseServersTest):
         request_to_sfs = ''
         rfr = RequestForReference(self.reference_queue, request_to_sfs, self.request_db, self.sna,
                                   self.sleep_change_value)
-        self.assertIsNone(rfr.check_incoming_correspondence(self.request_ids))
+        self.assertIsNone(rfr.check_incoming_correspondence(self.request_ids.items()))
         self.assertEqual(self.reference_queue.get(), ({"meta": {"id": "123"}}, []))
 
 
@@ -80,7 +80,7 @@ class TestRequestForReferenceWorker(BaseServersTest):
             self.request_db.add_sfs_request(key, value)
         rfr = RequestForReference(self.reference_queue, self.request_to_sfs, self.request_db, self.sna,
                                   self.sleep_change_value)
-        self.assertIsNone(rfr.check_incoming_correspondence(self.request_ids))
+        self.assertIsNone(rfr.check_incoming_correspondence(self.request_ids.items()))
         self.assertEqual(self.reference_queue.get(), ({"meta": {"id": "123"}}, []))
 
     def test_sfs_receiver_exception(self):
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+
+monkey.patch_all()
+
+import unittest
+
+from gevent import event, sleep
+from mock import MagicMock, patch
+
+from bot.dfs.bridge.workers.requests_compactor import RequestsCompactor
+
+
+class TestRequestsCompactor(unittest.TestCase):
+    def setUp(self):
+        self.requests_db = MagicMock()
+        self.sna = event.Event()
+        self.sna.set()
+        self.worker = RequestsCompactor(self.requests_db, self.sna, horizon=100, batch_size=2, interval=0.01)
+
+    def tearDown(self):
+        self.worker.shutdown()
+        del self.worker
+
+    def test_init(self):
+        self.assertEqual(self.worker.requests_db, self.requests_db)
+        self.assertEqual(self.worker.horizon, 100)
+        self.assertEqual(self.worker.batch_size, 2)
+        self.assertEqual(self.worker.interval, 0.01)
+        self.assertFalse(self.worker.exit)
+
+    @patch("bot.dfs.bridge.workers.requests_compactor.logger")
+    def test_compact(self, logger):
+        self.requests_db.expire_requests.return_value = iter([(2, 1, 3, 300), (1, 0, 2, 100)])
+        self.worker.immortal_jobs = self.worker._start_jobs()
+        sleep(0.005)
+        self.worker.shutdown()
+        sleep(0.02)
+        self.assertTrue(self.worker.immortal_jobs['compact'].dead)
+        self.assertEqual(self.requests_db.expire_requests.call_count, 1)
+        self.assertEqual(self.requests_db.expire_requests.call_args[0][1], 2)
+        self.assertEqual(logger.info.call_args[0][0], u"Requests compaction removed 3 requests (1 of them pending) "
+                                                      u"and 5 award bindings, reclaimed 400 bytes")
+        params = logger.info.call_args[1]["extra"]
+        self.assertEqual((params["JOURNAL_REMOVED_REQUESTS"], params["JOURNAL_REMOVED_PENDING_REQUESTS"],
+                          params["JOURNAL_REMOVED_AWARD_BINDINGS"], params["JOURNAL_RECLAIMED_BYTES"]), (3, 1, 5, 400))
+
+    def test_compact_exception(self):
+        self.requests_db.expire_requests.side_effect = [Exception("Redis is down"), iter([])]
+        self.worker.immortal_jobs = self.worker._start_jobs()
+        sleep(0.015)
+        self.worker.shutdown()
+        self.assertFalse(self.worker.immortal_jobs['compact'].exception)
+        self.assertEqual(self.requests_db.expire_requests.call_count, 2)
@@ -1,21 +1,22 @@
 # -*- coding: utf-8 -*-
-from gevent import event, monkey
+from gevent import event, getcurrent, monkey
 
 monkey.patch_all()
 
 import uuid
 import unittest
 import datetime
-from gevent.queue import Queue
 from mock import patch, MagicMock
 from time import sleep
 from munch import munchify
-from restkit.errors import Unauthorized, RequestFailed, ResourceError
+from restkit.errors import Unauthorized, RequestError, RequestFailed, ResourceError
 
-from bot.dfs.bridge.workers.scanner import Scanner
+from bot.dfs.bridge.workers.scanner import Scanner, checkpoint_key, prefetch, shard_direction
 from bot.dfs.tests.utils import custom_sleep
+from bot.dfs.bridge.dedup_filter import DedupFilter
 from bot.dfs.bridge.process_tracker import ProcessTracker
 from bot.dfs.bridge.sleep_change_value import APIRateController
+from bot.dfs.bridge.tender_queue import TenderQueue
 
 
 class TestScannerWorker(unittest.TestCase):
@@ -24,7 +25,7 @@ class TestScannerWorker(unittest.TestCase):
         self.tenders_id = [uuid.uuid4().hex for _ in range(4)]
         self.sleep_change_value = APIRateController()
         self.client = MagicMock()
-        self.tender_queue = Queue(10)
+        self.tender_queue = TenderQueue(10)
         self.sna = event.Event()
         self.sna.set()
         self.worker = Scanner.spawn(self.client, self.tender_queue, self.sna, self.process_tracker,
@@ -113,8 +114,8 @@ class TestScannerWorker(unittest.TestCase):
                                                 self.mock_tenders("active.qualification", self.tenders_id[2], 'EU')]
         self.sleep_change_value.increment_step = 1
         self.sleep_change_value.decrement_step = 0.5
-        for tender_id in self.tenders_id[0:3]:
-            self.assertEqual(self.tender_queue.get(), tender_id)
+        # live tenders are served before backfill ones, so only the set of tenders is certain
+        self.assertEqual(sorted(self.tender_queue.get() for _ in self.tenders_id[0:3]), sorted(self.tenders_id[0:3]))
 
     @patch('gevent.sleep')
     def test_forward_dead(self, gevent_sleep):
@@ -141,8 +142,8 @@ class TestScannerWorker(unittest.TestCase):
                                                 self.mock_tenders("active.qualification", self.tenders_id[2], 'EU')]
         self.sleep_change_value.increment_step = 1
         self.sleep_change_value.decrement_step = 0.5
-        for tender_id in self.tenders_id[0:3]:
-            self.assertEqual(self.tender_queue.get(), tender_id)
+        # live tenders are served before backfill ones, so only the set of tenders is certain
+        self.assertEqual(sorted(self.tender_queue.get() for _ in self.tenders_id[0:3]), sorted(self.tenders_id[0:3]))
 
     @patch('gevent.sleep')
     def test_get_tenders_exception(self, gevent_sleep):
@@ -158,8 +159,8 @@ class TestScannerWorker(unittest.TestCase):
                                                 self.mock_tenders("active.qualification", self.tenders_id[3], 'EU')]
         self.sleep_change_value.increment_step = 1
         self.sleep_change_value.decrement_step = 0.5
-        for tender_id in self.tenders_id:
-            self.assertEqual(self.tender_queue.get(), tender_id)
+        # live tenders are served before backfill ones, so only the set of tenders is certain
+        self.assertEqual(sorted(self.tender_queue.get() for _ in self.tenders_id), sorted(self.tenders_id))
 
     @patch('gevent.sleep')
     def test_resource_error(self, gevent_sleep):
@@ -197,3 +198,206 @@ class TestScannerWorker(unittest.TestCase):
                                                                                self.tenders_id[0], 'EU')])
         self.assertEqual(self.tender_queue.get(), self.tenders_id[0])
         self.assertEqual(self.worker.initialize_sync.call_count, 2)
+
+    @patch('gevent.sleep')
+    def test_resume_from_checkpoint(self, gevent_sleep):
+        """Backward and forward workers continue from offsets saved by previous run"""
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        checkpoints = {checkpoint_key("forward"): '100', checkpoint_key("backward"): '50'}
+        db = MagicMock(has=MagicMock(side_effect=lambda key: key in checkpoints),
+                       get=MagicMock(side_effect=lambda key: checkpoints[key]))
+        self.worker = Scanner(self.client, self.tender_queue, self.sna, self.process_tracker,
+                              self.sleep_change_value, db=db)
+        self.client.sync_tenders.return_value = self.mock_tenders("active.qualification", self.tenders_id[0], 'UA')
+        params = {'descending': 1}
+        self.worker.initialize_sync(params=params, direction="backward")
+        self.assertEqual(params['offset'], '50')
+        self.assertEqual(self.worker.initial_sync_point, {'forward_offset': '100', 'backward_offset': '50'})
+        params = {}
+        self.worker.initialize_sync(params=params, direction="forward")
+        self.assertEqual(params['offset'], '100')
+        db.put.assert_not_called()
+
+    @patch('gevent.sleep')
+    def test_full_resync_ignores_checkpoint(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        shard_key = checkpoint_key(shard_direction(100.0, 1000.0))
+        db = MagicMock(has=MagicMock(return_value=True), get=MagicMock(return_value='50'),
+                       scan_iter=MagicMock(return_value=iter([shard_key])))
+        self.worker = Scanner(self.client, self.tender_queue, self.sna, self.process_tracker,
+                              self.sleep_change_value, db=db, full_resync=True)
+        self.client.sync_tenders.return_value = self.mock_tenders("active.qualification", self.tenders_id[0], 'UA')
+        params = {'descending': 1}
+        self.worker.initialize_sync(params=params, direction="backward")
+        self.assertNotIn('offset', params)
+        self.assertEqual(self.worker.initial_sync_point, {'forward_offset': '123', 'backward_offset': '1234'})
+        db.put.assert_any_call(checkpoint_key("forward"), '123', None)
+        db.put.assert_any_call(checkpoint_key("backward"), '1234', None)
+        db.scan_iter.assert_called_once_with(checkpoint_key(shard_direction("*", "*")))
+        db.remove.assert_called_once_with(shard_key)
+        self.assertFalse(self.worker.full_resync)
+
+    @patch('gevent.sleep')
+    def test_checkpoint_saved_after_page(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.db = MagicMock(has=MagicMock(return_value=True), get=MagicMock(return_value='50'))
+        self.client.sync_tenders.side_effect = [self.mock_tenders("active.qualification", self.tenders_id[0], 'UA'),
+                                                self.mock_tenders("active.qualification", self.tenders_id[1], 'UA')]
+        # live tenders are served before backfill ones, so only the set of tenders is certain
+        self.assertEqual(sorted(self.tender_queue.get() for _ in self.tenders_id[0:2]), sorted(self.tenders_id[0:2]))
+        self.worker.db.put.assert_any_call(checkpoint_key("backward"), '1234', None)
+
+    def test_plan_shards(self):
+        self.worker.backward_shards = 4
+        self.worker.backward_history_days = 1
+        self.assertEqual(self.worker.plan_shards(172800.0), [(151200.0, 172800.0), (129600.0, 151200.0),
+                                                             (108000.0, 129600.0), (86400.0, 108000.0)])
+
+    @patch('gevent.sleep')
+    def test_put_shard_tenders_to_process(self, gevent_sleep):
+        """Shard stops when feed offset passes its lower bound and saves its own checkpoint"""
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        db = MagicMock(has=MagicMock(return_value=False))
+        self.worker = Scanner(self.client, self.tender_queue, self.sna, self.process_tracker,
+                              self.sleep_change_value, db=db)
+        first_page = self.mock_tenders("active.qualification", self.tenders_id[0], 'UA')
+        first_page.next_page.offset = '500'
+        second_page = self.mock_tenders("active.qualification", self.tenders_id[1], 'UA')
+        second_page.next_page.offset = '50'
+        self.client.sync_tenders.side_effect = [first_page, ResourceError(http_code=429), second_page]
+        self.worker.put_shard_tenders_to_process(100.0, 1000.0)
+        self.assertEqual(self.client.sync_tenders.call_count, 3)
+        self.assertEqual([self.tender_queue.get(), self.tender_queue.get()], self.tenders_id[0:2])
+        db.put.assert_called_with(checkpoint_key(shard_direction(100.0, 1000.0)), '50', None)
+
+    @patch('gevent.sleep')
+    def test_sync_backward_shards_processes_first_page(self, gevent_sleep):
+        """Tenders of the page which sets the sync point are put to process before shards start below it"""
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        self.worker = Scanner(self.client, self.tender_queue, self.sna, self.process_tracker,
+                              self.sleep_change_value, backward_shards=2)
+        self.client.sync_tenders.side_effect = [self.mock_tenders("active.qualification", self.tenders_id[0], 'UA'),
+                                                self.mock_tenders(None, None, None, False),
+                                                self.mock_tenders(None, None, None, False)]
+        self.worker.sync_backward_shards({'opt_fields': 'status', 'descending': 1, 'mode': '_all_'})
+        self.assertEqual(self.tender_queue.backfill.qsize(), 1)
+        self.assertEqual(self.tender_queue.get(), self.tenders_id[0])
+        self.assertEqual(self.client.sync_tenders.call_count, 3)
+
+    @patch('gevent.sleep')
+    def test_finished_shard_is_skipped(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        db = MagicMock(has=MagicMock(return_value=True), get=MagicMock(return_value='50'))
+        self.worker = Scanner(self.client, self.tender_queue, self.sna, self.process_tracker,
+                              self.sleep_change_value, db=db)
+        self.worker.put_shard_tenders_to_process(100.0, 1000.0)
+        self.client.sync_tenders.assert_not_called()
+
+    def test_page_delay(self):
+        self.worker.full_stack_sync_delay = 15
+        self.worker.empty_stack_sync_delay = 101
+        full_page = munchify({'data': [{'id': uuid.uuid4().hex} for _ in range(2)]})
+        self.assertEqual(self.worker.page_delay(full_page, {'limit': 2}), 0)
+        self.assertEqual(self.worker.page_delay(full_page, {}), 15)
+        self.assertEqual(self.worker.page_delay(self.mock_tenders(None, None, None, False), {}), 101)
+
+    @patch('gevent.sleep')
+    def test_sync_page_retries_server_error(self, gevent_sleep):
+        current, delays = getcurrent(), []
+
+        def record_sleep(seconds=0):
+            # workers of other tests may still be sleeping in their greenlets
+            if getcurrent() is current:
+                delays.append(seconds)
+            return custom_sleep()
+
+        gevent_sleep.side_effect = record_sleep
+        self.worker.kill()
+        self.worker = Scanner(self.client, self.tender_queue, self.sna, self.process_tracker,
+                              self.sleep_change_value, on_error_sleep_delay=2)
+        page = self.mock_tenders("active.qualification", self.tenders_id[0], 'UA')
+        self.client.sync_tenders.side_effect = [ResourceError(http_code=502), RequestError(), page]
+        self.assertEqual(self.worker.sync_page({}), page)
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(1 <= delays[0] <= 3)
+        self.assertTrue(2 <= delays[1] <= 6)
+
+    @patch('gevent.sleep')
+    def test_sync_page_gives_up(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.kill()
+        self.worker = Scanner(self.client, self.tender_queue, self.sna, self.process_tracker,
+                              self.sleep_change_value)
+        self.client.sync_tenders.side_effect = ResourceError(http_code=503)
+        with self.assertRaises(ResourceError):
+            self.worker.sync_page({})
+        self.assertEqual(self.client.sync_tenders.call_count, self.worker.max_error_retries + 1)
+
+    def test_prefetch(self):
+        fetched = []
+
+        def pages():
+            for i in range(5):
+                fetched.append(i)
+                yield i
+
+        buffered = prefetch(pages(), 2)
+        self.assertEqual(next(buffered), 0)
+        self.assertLessEqual(len(fetched), 4)
+        self.assertEqual(list(buffered), [1, 2, 3, 4])
+
+    def test_prefetch_exception(self):
+        def pages():
+            yield 1
+            raise ResourceError(http_code=403)
+
+        buffered = prefetch(pages(), 1)
+        self.assertEqual(next(buffered), 1)
+        with self.assertRaises(ResourceError):
+            next(buffered)
+
+    @patch('gevent.sleep')
+    def test_worker_with_prefetch(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.prefetch_pages = 2
+        self.client.sync_tenders.side_effect = [self.mock_tenders("active.qualification", self.tenders_id[0], 'UA'),
+                                                self.mock_tenders("active.tendering", uuid.uuid4().hex, 'UA'),
+                                                self.mock_tenders("active.qualification", self.tenders_id[1], 'EU'),
+                                                self.mock_tenders("active.qualification", self.tenders_id[2], 'EU')]
+        self.assertEqual(sorted(self.tender_queue.get() for _ in range(3)), sorted(self.tenders_id[0:3]))
+
+    @patch('gevent.sleep')
+    def test_skip_not_modified_tender(self, gevent_sleep):
+        """Tender with the same dateModified as at last fetch is not put to process again"""
+        gevent_sleep.side_effect = custom_sleep
+        self.process_tracker._db = MagicMock(get=MagicMock(side_effect=lambda key: "2017-10-10"),
+                                             has=MagicMock(return_value=False))
+        not_modified = self.mock_tenders("active.qualification", self.tenders_id[0], 'UA')
+        not_modified.data[0].dateModified = "2017-10-10"
+        modified = self.mock_tenders("active.qualification", self.tenders_id[1], 'UA')
+        modified.data[0].dateModified = "2017-10-11"
+        self.client.sync_tenders.side_effect = [not_modified, modified]
+        self.assertEqual(self.tender_queue.get(), self.tenders_id[1])
+        self.assertEqual(self.process_tracker.scheduled_tenders, {self.tenders_id[1]: "2017-10-11"})
+
+    @patch('gevent.sleep')
+    def test_skip_duplicate_tender(self, gevent_sleep):
+        gevent_sleep.side_effect = custom_sleep
+        self.worker.dedup_filter = DedupFilter()
+        self.client.sync_tenders.side_effect = [self.mock_tenders("active.qualification", self.tenders_id[0], 'UA'),
+                                                self.mock_tenders("active.qualification", self.tenders_id[0], 'UA'),
+                                                self.mock_tenders("active.qualification", self.tenders_id[1], 'UA')]
+        for tender_id in self.tenders_id[0:2]:
+            self.assertEqual(self.tender_queue.get(), tender_id)
+        self.assertEqual(self.worker.dedup_filter.hits, 1)
+
+    def test_put_tender_to_process_priority(self):
+        self.worker.put_tender_to_process({'id': self.tenders_id[0]}, backfill=True)
+        self.worker.put_tender_to_process({'id': self.tenders_id[1]})
+        self.assertEqual(self.tender_queue.backfill.qsize(), 1)
+        self.assertEqual(self.tender_queue.get(), self.tenders_id[1])
@@ -1,13 +1,16 @@
 # coding=utf-8
+from datetime import date
+
 from bot.dfs.bridge.data import Data
 from bot.dfs.bridge.process_tracker import ProcessTracker
-from bot.dfs.bridge.requests_db import RequestsDb
+from bot.dfs.bridge.requests_db import RequestsDb, code_owners_key, code_pending_key
 from bot.dfs.bridge.requests_to_sfs import RequestsToSfs
-from bot.dfs.bridge.sleep_change_value import APIRateController
+from bot.dfs.bridge.sleep_change_value import APIRateController, TokenBucket
 from bot.dfs.bridge.workers.sfs_worker import SfsWorker
 from bot.dfs.tests.base import BaseServersTest
-from gevent import event
+from gevent import event, spawn, sleep
 from gevent.queue import Queue
+from mock import MagicMock
 
 
 class TestSfsWorker(BaseServersTest):
@@ -24,6 +27,10 @@ class TestSfsWorker(BaseServersTest):
         self.worker = SfsWorker(sfs_client, sfs_reqs_queue, upload_to_api_queue,
                                 process_tracker, redis_db, services_not_available, sleep_change_value)
 
+    def tearDown(self):
+        del self.worker
+        self.redis.flushall()
+
     def test_init(self):
         sfs_client = RequestsToSfs()
         sfs_reqs_queue = Queue(10)
@@ -45,11 +52,12 @@ class TestSfsWorker(BaseServersTest):
 
     def test_process_new_request(self):
         data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
-        self.worker.process_new_request(data)
+        self.worker.process_new_request(data, "111")
+        self.assertEqual(data.file_content['meta']['sourceRequests'], ["111"])
 
     def test_process_new_request_physical(self):
         data = Data(1, 1, 1234567890, "last_name first_name family_name", {"meta": {"sourceRequests": []}})
-        self.worker.process_new_request(data)
+        self.worker.process_new_request(data, "111")
 
     def test_process_existing_request(self):
         data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
@@ -60,5 +68,122 @@ class TestSfsWorker(BaseServersTest):
         data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
         req_id = 111
         self.worker.requests_db.add_sfs_request(req_id, {"code": data.code, "status": "pending"})
-        self.worker.requests_db.complete_request(req_id)
+        self.worker.requests_db.complete_request(req_id, data.code)
         self.worker.process_existing_request(data, req_id)
+
+    def test_process_new_request_acquires_token(self):
+        self.worker.sfs_rate_limiter = MagicMock()
+        data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.process_new_request(data, "111")
+        self.worker.sfs_rate_limiter.acquire.assert_called_once_with()
+
+    def test_process_existing_request_skips_token(self):
+        self.worker.sfs_rate_limiter = MagicMock()
+        data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.process_existing_request(data, 111)
+        self.assertFalse(self.worker.sfs_rate_limiter.acquire.called)
+
+    def test_default_rate_limiter(self):
+        self.assertIsInstance(self.worker.sfs_rate_limiter, TokenBucket)
+        self.assertEqual(self.worker.sfs_rate_limiter.rate, 1 / 15.0)
+
+    def test_process_request_new(self):
+        self.worker.sfs_client = MagicMock()
+        data = Data(1, 2, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.process_request(data)
+        self.assertEqual(self.worker.sfs_client.post.call_count, 1)
+        request_id = data.file_content['meta']['sourceRequests'][0]
+        self.assertEqual(self.redis.smembers(code_pending_key(12345678)), {request_id})
+        self.assertEqual(self.redis.hget(code_owners_key(12345678), "1:2"), request_id)
+        self.assertEqual(self.worker.upload_to_api_queue.qsize(), 0)
+
+    def test_process_request_existing(self):
+        self.worker.sfs_client = MagicMock()
+        self.worker.requests_db.add_sfs_request("111", {"code": 12345678, "status": "pending"})
+        data = Data(1, 2, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.process_request(data)
+        self.assertFalse(self.worker.sfs_client.post.called)
+        self.assertEqual(self.redis.hget(code_owners_key(12345678), "1:2"), "111")
+        self.assertEqual(self.worker.upload_to_api_queue.get(), (data, {"code": "12345678", "status": "pending"}))
+
+    def test_process_request_in_flight(self):
+        self.worker.sfs_client = MagicMock()
+        self.worker.sfs_client.post.side_effect = lambda *args: sleep(0.1)
+        first = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        second = Data(2, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        jobs = [spawn(self.worker.process_request, first), spawn(self.worker.process_request, second)]
+        for job in jobs:
+            job.join()
+        self.assertEqual(self.worker.sfs_client.post.call_count, 1)
+        request_id = first.file_content['meta']['sourceRequests'][0]
+        self.assertEqual(self.redis.hget(code_owners_key(12345678), "2:1"), request_id)
+        self.assertEqual(self.worker.upload_to_api_queue.qsize(), 1)
+        self.assertEqual(self.worker.in_flight, {})
+
+    def test_process_request_saves_source_request(self):
+        self.worker.sfs_client = MagicMock()
+        data = Data("t1", "a", 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.process_request(data)
+        request_id = data.file_content['meta']['sourceRequests'][0]
+        self.assertEqual(self.worker.requests_db.get_tenders_of_request(request_id, 12345678), [data])
+
+    def test_process_request_post_fails(self):
+        day = date(2017, 10, 10)
+        self.worker.sfs_quota = MagicMock(current_allowance=MagicMock(return_value=(day, 5)))
+        self.worker.sfs_client = MagicMock()
+        self.worker.sfs_client.post.side_effect = Exception("Connection refused")
+        data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.process_request(data)
+        self.assertEqual(self.worker.sfs_reqs_queue.get(), data)
+        self.assertEqual(data.file_content['meta']['sourceRequests'], [])
+        self.assertEqual(self.worker.requests_db.daily_requests(day), 0)
+        self.assertEqual(self.worker.requests_db.recent_requests_with(12345678), [])
+        self.assertIsNone(self.redis.hget(code_owners_key(12345678), "1:1"))
+        self.assertEqual(self.worker.upload_to_api_queue.qsize(), 0)
+
+    def test_process_request_in_flight_post_fails(self):
+        """Award which waited for a request that could not be sent registers its own"""
+        self.worker.sfs_client = MagicMock()
+        self.worker.sfs_client.post.side_effect = [Exception("Connection refused"), None]
+        first = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        second = Data(2, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        jobs = [spawn(self.worker.process_request, first), spawn(self.worker.process_request, second)]
+        for job in jobs:
+            job.join()
+        self.assertEqual(self.worker.sfs_client.post.call_count, 2)
+        request_id = second.file_content['meta']['sourceRequests'][0]
+        self.assertEqual(self.worker.requests_db.recent_requests_with(12345678), [request_id])
+        self.assertEqual(self.worker.sfs_reqs_queue.get(), first)
+        self.assertEqual(self.worker.upload_to_api_queue.qsize(), 0)
+
+    def test_process_request_quota_exhausted(self):
+        self.worker.sfs_quota = MagicMock(current_allowance=MagicMock(return_value=(date(2017, 10, 10), 0)))
+        self.worker.sfs_client = MagicMock()
+        data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.process_request(data)
+        self.assertFalse(self.worker.sfs_client.post.called)
+        self.assertEqual(self.redis.smembers(code_pending_key(12345678)), set())
+        self.assertEqual(self.worker.requests_db.pop_backlog(), data)
+
+    def test_process_backlog(self):
+        self.worker.sfs_quota = MagicMock(available=MagicMock(return_value=True))
+        self.worker.process_request = MagicMock()
+        data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.requests_db.add_to_backlog(data)
+        job = spawn(self.worker.process_backlog)
+        sleep(0.1)
+        self.worker.shutdown()
+        job.kill()
+        self.worker.pool.join()
+        self.worker.process_request.assert_called_once_with(data)
+        self.assertEqual(self.worker.requests_db.backlog_size(), 0)
+
+    def test_process_backlog_quota_exhausted(self):
+        self.worker.sfs_quota = MagicMock(available=MagicMock(return_value=False))
+        self.worker.backlog_delay = 0.01
+        data = Data(1, 1, 12345678, "comname", {"meta": {"sourceRequests": []}})
+        self.worker.requests_db.add_to_backlog(data)
+        job = spawn(self.worker.process_backlog)
+        sleep(0.05)
+        job.kill()
+        self.assertEqual(self.worker.requests_db.backlog_size(), 1)
@@ -26,7 +26,8 @@ databridge_requires = requires + [
     'LazyDB',
     'ExtendedJournalHandler',
     'requests',
-    'openprocurement_client>=1.0b2'
+    'openprocurement_client>=1.0b2',
+    'ujson'
 ]
 
 entry_points = {
@@ -58,6 +59,8 @@ setup(name='bot.dfs',
       install_requires=requires,
       tests_require=test_requires,
       extras_require={'bridge': databridge_requires,
+                      'hiredis': ['hiredis'],
+                      'cluster': ['redis-py-cluster<2'],
                       'test': test_requires},
       entry_points=entry_points,
       )